@@ -0,0 +1,271 @@
+# benchmarks of the dashboard's data paths on synthetic lead exports (see generate_leads.py). For every file size the
+# ingest steps are timed one by one, then every callback is run once cold and once warm through the Dash test client,
+# so the numbers include request decoding and JSON encoding like in the browser. Results are written as JSON so runs of
+# two releases can be compared:
+#
+#   python benchmarks/bench_data_paths.py --rows 10000 100000 1000000 --output after.json
+#   python benchmarks/bench_data_paths.py --rows 10000 100000 --output after.json --compare before.json
+#
+# The peak RSS of the process is recorded after every size; --trace-memory adds the peak allocation of every stage.
+# Runs offline; nothing is written outside a temporary directory unless --work-dir is given.
+
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:     # not on Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from generate_leads import generate_leads, write_leads_xlsx
+
+#Function to import the dashboard against a private cache directory, with heavy callbacks run in the request (no
+#background job manager) so their timings don't include job polling
+def import_dashboard(cache_dir):
+    os.environ['SALES_DASH_CACHE_DIR'] = cache_dir
+    sys.modules['diskcache'] = None
+    import sales_dashboard
+    return sales_dashboard
+
+#Function to time fn(), with the peak memory allocated while it runs when tracemalloc is tracing (None otherwise)
+def measure(fn):
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = max(tracemalloc.get_traced_memory()[1] - base, 0) if tracing else None
+    return result, {'seconds': round(seconds, 6), 'peak_bytes': peak}
+
+#Function to find the callback_map key of the callback writing to the given output id
+def callback_key(app, output_id):
+    for key in app.callback_map:
+        outputs = key.strip('.').split('...')
+        if any(output.split('.')[0] == output_id for output in outputs):
+            return key
+    raise KeyError(output_id)
+
+#Function to run a callback through the Dash test client like the browser does, values maps 'id.property' to values
+def run_callback(app, client, output_id, values, triggered):
+    key = callback_key(app, output_id)
+    callback = app.callback_map[key]
+    dependency = lambda dep: {'id': dep['id'], 'property': dep['property'], 'value': values.get(f"{dep['id']}.{dep['property']}")}
+    if key.startswith('..'):
+        outputs = [dict(zip(('id', 'property'), output.split('.'))) for output in key.strip('.').split('...')]
+    else:
+        outputs = dict(zip(('id', 'property'), key.split('.')))
+    response = client.post('/_dash-update-component', json={
+        'output': key,
+        'outputs': outputs,
+        'inputs': [dependency(dep) for dep in callback['inputs']],
+        'state': [dependency(dep) for dep in callback.get('state', [])],
+        'changedPropIds': [triggered],
+    })
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f'{output_id} callback failed with {response.status_code}: {response.data[:500]!r}')
+    return response.data
+
+# callbacks timed after ingest: (name, output id, triggering property), each run cold and then warm
+CALLBACKS = [
+    ('make_table', 'data-table-component', 'dataset-id.data'),
+    ('page_datatable', 'datatable-interactivity', 'datatable-interactivity.page_current'),
+    ('page_datatable_filtered', 'datatable-interactivity', 'datatable-interactivity.filter_query'),
+    ('display_duplicate_records', 'view-duplicate-records', 'dataset-id.data'),
+    ('page_duplicate_records', 'duplicate-records-table', 'duplicate-records-table.page_current'),
+    ('display_missing_contact_owner_records', 'view-missing-contact-owner-records', 'dataset-id.data'),
+    ('page_missing_contact_owner_records', 'missing-contact-owner-table', 'missing-contact-owner-table.page_current'),
+    ('download_missing_contact_owner_records', 'download-missing-contact-owner-records', 'download-missing-contact-owner-button.n_clicks'),
+    ('country_map', 'country-map', 'dataset-id.data'),
+    ('country_map_year_change', 'country-map', 'year-input.value'),
+    ('country_pie_chart', 'country-pie-chart', 'dataset-id.data'),
+    ('lead_source_pie_chart', 'lead-source-pie-chart', 'dataset-id.data'),
+    ('contact_owner_pie_chart', 'contact-owner-pie-chart', 'dataset-id.data'),
+    ('lead_status_pie_chart', 'lead-status-pie-chart', 'dataset-id.data'),
+    ('month_pie_chart', 'month-pie-chart', 'dataset-id.data'),
+    ('age_pie_chart', 'age-pie-chart', 'dataset-id.data'),
+    ('trend_chart', 'trend-chart', 'dataset-id.data'),
+    ('trend_chart_all_years_daily', 'trend-chart', 'trend-range.value'),
+    ('data_quality', 'data-quality-table', 'dataset-id.data'),
+    ('export_year_xlsx', 'export-download', 'export-button.n_clicks'),
+    ('export_year_csv', 'export-download', 'export-button.n_clicks'),
+]
+
+#Function to benchmark one synthetic file, returns its result record
+def run_size(sd, rows, duplicate_rate, seed, work_dir, year):
+    stages = []
+
+    def stage(name, fn, **extra):
+        result, timing = measure(fn)
+        stages.append(dict(name=name, **timing, **extra))
+        peak = '' if timing['peak_bytes'] is None else f'{timing["peak_bytes"] / 2**20:>10.1f} MiB'
+        print(f'  {name:<46} {timing["seconds"]:>10.3f} s {peak}', file=sys.stderr)
+        return result
+
+    path = os.path.join(work_dir, f'leads-{rows}-{duplicate_rate}-{seed}.xlsx')
+    if not os.path.exists(path):
+        leads = stage('generate', lambda: generate_leads(rows, duplicate_rate, seed, start_year=year - 1))
+        stage('write_source_xlsx', lambda: write_leads_xlsx(leads, path))
+        del leads
+    with open(path, 'rb') as f:
+        raw_bytes = f.read()
+    contents = 'data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,' + base64.b64encode(raw_bytes).decode()
+
+    # ingest path, step by step
+    df = stage('parse_workbook', lambda: sd.parse_workbook(raw_bytes))
+    # the file read the other way (streamed if it was read in one go, and the other way round) must give the same frame
+    streamed = len(raw_bytes) >= sd.STREAMING_INGEST_BYTES
+    threshold, sd.STREAMING_INGEST_BYTES = sd.STREAMING_INGEST_BYTES, len(raw_bytes) + 1 if streamed else 0
+    try:
+        other = stage('parse_workbook_other_path', lambda: sd.parse_workbook(raw_bytes))
+    finally:
+        sd.STREAMING_INGEST_BYTES = threshold
+    pd.testing.assert_frame_equal(df, other)
+    del other
+    stage('duplicate_clusters', lambda: sd.duplicate_clusters(df))
+    stage('write_parquet', lambda: sd.write_cached_file('bench', df))
+    stage('read_parquet', lambda: sd.read_cached_file('bench'))
+    stage('build_partitions', lambda: sd.build_partitions(df))
+    stage('build_cube', lambda: sd.build_cube(df))
+    frame_bytes = int(df.memory_usage(deep=True).sum())
+    del df
+
+    app = sd.app
+    client = app.server.test_client()
+    values = {'upload-data.contents': [contents], 'append-upload.value': False}
+    stage('ingest_upload', lambda: run_callback(app, client, 'dataset-id', values, 'upload-data.contents'))
+    dataset_id = sd.ingest_contents(contents)       # already in memory, only hashes the upload
+    del contents
+
+    with sd._dataset_cache_lock:
+        sd._dataset_cache.clear()                   # the next lookup reloads the dataset from its parquet file
+    stage('reload_dataset', lambda: sd.get_dataset(dataset_id))
+    stage('select_year', lambda: sd.select_rows(dataset_id, year))
+    stage('select_month', lambda: sd.select_rows(dataset_id, year, '03'))
+
+    values.update({
+        'dataset-id.data': dataset_id, 'year-input.value': year, 'month-dropdown.value': '',
+        'export-view.value': 'year', 'export-button.n_clicks': 1,
+        'view-duplicate-button.n_clicks': 1, 'download-missing-contact-owner-button.n_clicks': 1,
+        'trend-granularity.value': 'week', 'trend-breakdown.value': 'Lead Source', 'trend-range.value': 'period',
+    })
+    for table in ('datatable-interactivity', 'duplicate-records-table', 'missing-contact-owner-table'):
+        values.update({f'{table}.page_current': 0, f'{table}.page_size': 10, f'{table}.sort_by': [], f'{table}.filter_query': ''})
+
+    for name, output_id, triggered in CALLBACKS:
+        values['export-format.value'] = 'csv' if name.endswith('_csv') else 'xlsx'
+        if name == 'page_datatable_filtered':
+            values.update({'datatable-interactivity.filter_query': '{Lead Status} = Open && {Phone Number} contains 9',
+                           'datatable-interactivity.sort_by': [{'column_id': 'Create Date', 'direction': 'desc'}]})
+        if name == 'trend_chart_all_years_daily':
+            values.update({'trend-granularity.value': 'day', 'trend-range.value': 'all'})
+        for run in ('cold', 'warm'):
+            response = stage(f'{name} ({run})', lambda: run_callback(app, client, output_id, values, triggered))
+            stages[-1]['response_bytes'] = len(response)
+
+    result = {
+        'rows': rows,
+        'duplicate_rate': duplicate_rate,
+        'seed': seed,
+        'file_bytes': len(raw_bytes),
+        'frame_bytes': frame_bytes,
+        'stages': stages,
+    }
+    if resource is not None:
+        result['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return result
+
+#Function to describe the environment the numbers were taken in
+def environment():
+    versions = {}
+    for name in ('pandas', 'numpy', 'dash', 'plotly', 'openpyxl', 'pyarrow', 'xlsxwriter'):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+    }
+
+#Function to print the time of every stage against an earlier results file
+def compare(previous, current):
+    before = {(run['rows'], run['duplicate_rate'], stage['name']): stage['seconds'] for run in previous['runs'] for stage in run['stages']}
+    print(f'{"rows":>9}  {"stage":<46} {"before":>10} {"after":>10} {"change":>8}', file=sys.stderr)
+    for run in current['runs']:
+        for stage in run['stages']:
+            old = before.get((run['rows'], run['duplicate_rate'], stage['name']))
+            if old is None:
+                continue
+            change = f'{(stage["seconds"] - old) / old:+.0%}' if old else ''
+            print(f'{run["rows"]:>9}  {stage["name"]:<46} {old:>10.3f} {stage["seconds"]:>10.3f} {change:>8}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's data paths on synthetic lead exports")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000],
+                        help='file sizes to run, e.g. 10000 100000 1000000')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--year', type=int, default=2023, help='year selected in the dashboard (leads span it and the year before)')
+    parser.add_argument('--work-dir', help='keep generated files and caches here instead of a temporary directory')
+    parser.add_argument('--output', help='write the results JSON here instead of stdout')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record the peak memory of every stage with tracemalloc (slows pure Python stages like '
+                             'parse_workbook several times over, so compare timings only between runs with the same setting)')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='sales-dash-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        cache_dir = os.path.join(work_dir, 'cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)     # nothing may be served from an earlier run
+        sd = import_dashboard(cache_dir)
+        if args.trace_memory:
+            tracemalloc.start()
+        results = {'environment': dict(environment(), trace_memory=args.trace_memory), 'runs': []}
+        for rows in args.rows:
+            with sd._dataset_cache_lock:
+                sd._dataset_cache.clear()
+            print(f'{rows:,} rows', file=sys.stderr)
+            results['runs'].append(run_size(sd, rows, args.duplicate_rate, args.seed, work_dir, args.year))
+        if args.trace_memory:
+            tracemalloc.stop()
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,114 @@
+# startup benchmark: how long a fresh process takes to import sales_dashboard, build the app with create_app and answer
+# its first page load, the cost every gunicorn worker (re)start and every script importing the module pays. Each
+# sample runs in a new interpreter. Also lists the heavy modules that got imported on the way, which should only be
+# loaded when they are used (plotly.express for figures, openpyxl / xlsxwriter for uploads and exports)
+#
+#   python benchmarks/bench_startup.py --repeat 10 --output startup.json
+#   python benchmarks/bench_startup.py --output after.json --compare before.json
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bench_data_paths import environment
+
+LAZY_MODULES = ['plotly.express', 'openpyxl', 'xlsxwriter', 'pyarrow.parquet', 'multiprocess']
+
+# run in the child interpreter, prints one JSON line
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import sales_dashboard
+imported = time.perf_counter()
+lazy_at_import = [name for name in LAZY_MODULES if name in sys.modules]
+app = sales_dashboard.create_app()
+created = time.perf_counter()
+client = app.server.test_client()
+for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+    assert client.get(path).status_code == 200, path
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_page_load': served - created,
+    'total': served - start,
+    'lazy_modules_at_import': lazy_at_import,
+    'modules_loaded': len(sys.modules),
+}))
+'''
+
+#Function to run one sample in a new interpreter
+def run_child(cache_dir):
+    env = dict(os.environ, SALES_DASH_CACHE_DIR=cache_dir)
+    code = f'LAZY_MODULES = {LAZY_MODULES!r}\n' + CHILD
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(HERE), env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+#Function to get the slowest top-level imports of sales_dashboard from python -X importtime, in seconds
+def slowest_imports(cache_dir, count=10):
+    env = dict(os.environ, SALES_DASH_CACHE_DIR=cache_dir)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import sales_dashboard'], cwd=os.path.dirname(HERE),
+                            env=env, capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if len(name) - len(name.lstrip()) <= 3:     # imported by sales_dashboard itself
+            imports.append({'module': name.strip(), 'seconds': int(cumulative) / 1e6})
+    return sorted(imports, key=lambda item: item['seconds'], reverse=True)[:count]
+
+#Function to print every stage against an earlier results file
+def compare(previous, current):
+    before = {stage['name']: stage['seconds'] for stage in previous['stages']}
+    print(f'{"stage":<20} {"before":>10} {"after":>10} {"change":>8}', file=sys.stderr)
+    for stage in current['stages']:
+        old = before.get(stage['name'])
+        if old:
+            print(f'{stage["name"]:<20} {old:>10.3f} {stage["seconds"]:>10.3f} {(stage["seconds"] - old) / old:>+8.0%}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark importing the dashboard and building its app')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters to time')
+    parser.add_argument('--output', help='write the results JSON here instead of stdout')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='sales-dash-startup-') as cache_dir:
+        run_child(cache_dir)                                    # warm the OS file cache and .pyc files
+        samples = [run_child(cache_dir) for _ in range(args.repeat)]
+        imports = slowest_imports(cache_dir)
+
+    stages = [{'name': name, 'seconds': round(statistics.median(sample[name] for sample in samples), 6),
+               'samples': [round(sample[name], 6) for sample in samples]}
+              for name in ('import', 'create_app', 'first_page_load', 'total')]
+    for stage in stages:
+        print(f'{stage["name"]:<20} {stage["seconds"]:>10.3f} s (median of {args.repeat})', file=sys.stderr)
+    results = {
+        'environment': environment(),
+        'repeat': args.repeat,
+        'stages': stages,
+        'lazy_modules_at_import': samples[-1]['lazy_modules_at_import'],
+        'modules_loaded': samples[-1]['modules_loaded'],
+        'slowest_imports': imports,
+    }
+    if results['lazy_modules_at_import']:
+        print(f'imported at startup but only needed later: {", ".join(results["lazy_modules_at_import"])}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,100 @@
+# synthetic HubSpot-style lead exports for the benchmarks, with the columns and the kinds of mess the dashboard
+# has to deal with: phone numbers with country codes and spaces, emails differing only in case / spaces, typed ages,
+# blank cells, 'NA' / 'N/A' typed for a missing value and a configurable share of leads that duplicate an earlier lead
+# by phone, email or both
+#
+#   python benchmarks/generate_leads.py 100000 leads.xlsx --duplicate-rate 0.1
+
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+COUNTRIES = ['India', 'india ', 'United States', 'USA', 'United Arab Emirates', 'UAE', 'United Kingdom', 'Singapore',
+             'Australia', 'Canada', 'NA', None]
+LEAD_SOURCES = ['Facebook', 'Google', 'Instagram', 'Referral', 'Website', None]
+CONTACT_OWNERS = ['Asha Rao', 'Ben Cole', 'Chen Li', 'Divya Nair', 'Emma Stone', 'Farid Khan', None]
+LEAD_STATUSES = ['New', 'Open', 'In Progress', 'Connected', 'Unqualified', 'Closed', 'N/A', None]
+AGES = [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 20, 21, 22, 25, 30, 10.5, 'ten', 'NA', -1, None]
+
+COLUMNS = ['Record ID', 'First Name', 'Email', 'Phone Number', 'Create Date', 'Lead Source', 'Country/Region',
+           'Contact owner', 'Lead Status', 'Age of your Child']
+
+#Function to pick one value of choices per row, as an object array
+def _choose(rng, choices, rows):
+    return np.array(choices, dtype=object)[rng.integers(0, len(choices), rows)]
+
+#Function to format 10 digit phone numbers the way they are typed into lead forms
+def _format_phones(rng, digits):
+    styles = rng.integers(0, 4, len(digits))
+    text = np.char.mod('%010d', digits).astype(object)
+    spaced = np.array([f'{p[:5]} {p[5:]}' for p in text], dtype=object)
+    return np.select([styles == 0, styles == 1, styles == 2],
+                     [text, '+91 ' + spaced, '+1 ' + text],
+                     '+91' + text).astype(object)
+
+#Function to generate a frame of synthetic leads created over the given years. duplicate_rate is the share of leads
+#that repeat the phone number, the email or both of an earlier lead (with different formatting)
+def generate_leads(rows, duplicate_rate=0.05, seed=0, start_year=2022, years=2):
+    rng = np.random.default_rng(seed)
+
+    start = datetime.datetime(start_year, 1, 1)
+    seconds = int((datetime.datetime(start_year + years, 1, 1) - start).total_seconds())
+    create_dates = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, seconds, rows), unit='s')
+
+    phone_digits = rng.integers(6_000_000_000, 9_999_999_999, rows)
+    emails = np.char.mod('lead%d@example.com', np.arange(rows)).astype(object)
+
+    # duplicates copy the phone, the email or both of a random earlier lead
+    duplicates = np.flatnonzero(rng.random(rows) < duplicate_rate)
+    duplicates = duplicates[duplicates > 0]
+    originals = (rng.random(len(duplicates)) * duplicates).astype(np.int64)
+    match = rng.integers(0, 3, len(duplicates))         # 0 phone, 1 email, 2 both
+    phone_dupes, email_dupes = duplicates[match != 1], duplicates[match != 0]
+    phone_digits[phone_dupes] = phone_digits[originals[match != 1]]
+    emails[email_dupes] = [f' {email.upper()}' for email in emails[originals[match != 0]]]
+
+    phones = _format_phones(rng, phone_digits)
+    phones[rng.random(rows) < 0.05] = None
+    phones[rng.random(rows) < 0.01] = '1234'
+    emails[rng.random(rows) < 0.05] = None
+
+    return pd.DataFrame({
+        'Record ID': np.arange(1, rows + 1) + 10_000_000,
+        'First Name': np.char.mod('Lead %d', np.arange(rows)).astype(object),
+        'Email': emails,
+        'Phone Number': phones,
+        'Create Date': create_dates,
+        'Lead Source': _choose(rng, LEAD_SOURCES, rows),
+        'Country/Region': _choose(rng, COUNTRIES, rows),
+        'Contact owner': _choose(rng, CONTACT_OWNERS, rows),
+        'Lead Status': _choose(rng, LEAD_STATUSES, rows),
+        'Age of your Child': _choose(rng, AGES, rows),
+    }, columns=COLUMNS)
+
+#Function to write generated leads to an xlsx file, row by row in xlsxwriter's constant_memory mode
+def write_leads_xlsx(df, path):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    try:
+        worksheet = workbook.add_worksheet('Sheet1')
+        worksheet.write_row(0, 0, list(df.columns))
+        values = df.astype(object).where(df.notna(), None)
+        for row_number, row in enumerate(values.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_number, 0, row)
+    finally:
+        workbook.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic lead export')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path', help='xlsx file to write')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-year', type=int, default=2022)
+    parser.add_argument('--years', type=int, default=2)
+    args = parser.parse_args()
+    write_leads_xlsx(generate_leads(args.rows, args.duplicate_rate, args.seed, args.start_year, args.years), args.path)
@@ -0,0 +1,125 @@
+# ISO 3166-1 country codes for the country map. The 'Country/Region' column of lead exports is free text ('india ',
+# 'USA', 'U.A.E.', 'United Kingdom'), country_code maps such a value to its ISO-3 code, so the map is drawn from codes
+# instead of plotly resolving names in the browser and dropping the ones it doesn't know
+
+import functools
+import re
+import unicodedata
+
+# (ISO-2, ISO-3, name shown on the map)
+COUNTRIES = [
+    ('AF', 'AFG', 'Afghanistan'), ('AX', 'ALA', 'Åland Islands'), ('AL', 'ALB', 'Albania'), ('DZ', 'DZA', 'Algeria'),
+    ('AS', 'ASM', 'American Samoa'), ('AD', 'AND', 'Andorra'), ('AO', 'AGO', 'Angola'), ('AI', 'AIA', 'Anguilla'),
+    ('AQ', 'ATA', 'Antarctica'), ('AG', 'ATG', 'Antigua and Barbuda'), ('AR', 'ARG', 'Argentina'), ('AM', 'ARM', 'Armenia'),
+    ('AW', 'ABW', 'Aruba'), ('AU', 'AUS', 'Australia'), ('AT', 'AUT', 'Austria'), ('AZ', 'AZE', 'Azerbaijan'),
+    ('BS', 'BHS', 'Bahamas'), ('BH', 'BHR', 'Bahrain'), ('BD', 'BGD', 'Bangladesh'), ('BB', 'BRB', 'Barbados'),
+    ('BY', 'BLR', 'Belarus'), ('BE', 'BEL', 'Belgium'), ('BZ', 'BLZ', 'Belize'), ('BJ', 'BEN', 'Benin'),
+    ('BM', 'BMU', 'Bermuda'), ('BT', 'BTN', 'Bhutan'), ('BO', 'BOL', 'Bolivia'),
+    ('BQ', 'BES', 'Bonaire, Sint Eustatius and Saba'), ('BA', 'BIH', 'Bosnia and Herzegovina'), ('BW', 'BWA', 'Botswana'),
+    ('BV', 'BVT', 'Bouvet Island'), ('BR', 'BRA', 'Brazil'), ('IO', 'IOT', 'British Indian Ocean Territory'),
+    ('BN', 'BRN', 'Brunei'), ('BG', 'BGR', 'Bulgaria'), ('BF', 'BFA', 'Burkina Faso'), ('BI', 'BDI', 'Burundi'),
+    ('CV', 'CPV', 'Cabo Verde'), ('KH', 'KHM', 'Cambodia'), ('CM', 'CMR', 'Cameroon'), ('CA', 'CAN', 'Canada'),
+    ('KY', 'CYM', 'Cayman Islands'), ('CF', 'CAF', 'Central African Republic'), ('TD', 'TCD', 'Chad'), ('CL', 'CHL', 'Chile'),
+    ('CN', 'CHN', 'China'), ('CX', 'CXR', 'Christmas Island'), ('CC', 'CCK', 'Cocos (Keeling) Islands'),
+    ('CO', 'COL', 'Colombia'), ('KM', 'COM', 'Comoros'), ('CG', 'COG', 'Congo'),
+    ('CD', 'COD', 'Democratic Republic of the Congo'), ('CK', 'COK', 'Cook Islands'), ('CR', 'CRI', 'Costa Rica'),
+    ('CI', 'CIV', "Côte d'Ivoire"), ('HR', 'HRV', 'Croatia'), ('CU', 'CUB', 'Cuba'), ('CW', 'CUW', 'Curaçao'),
+    ('CY', 'CYP', 'Cyprus'), ('CZ', 'CZE', 'Czechia'), ('DK', 'DNK', 'Denmark'), ('DJ', 'DJI', 'Djibouti'),
+    ('DM', 'DMA', 'Dominica'), ('DO', 'DOM', 'Dominican Republic'), ('EC', 'ECU', 'Ecuador'), ('EG', 'EGY', 'Egypt'),
+    ('SV', 'SLV', 'El Salvador'), ('GQ', 'GNQ', 'Equatorial Guinea'), ('ER', 'ERI', 'Eritrea'), ('EE', 'EST', 'Estonia'),
+    ('SZ', 'SWZ', 'Eswatini'), ('ET', 'ETH', 'Ethiopia'), ('FK', 'FLK', 'Falkland Islands'), ('FO', 'FRO', 'Faroe Islands'),
+    ('FJ', 'FJI', 'Fiji'), ('FI', 'FIN', 'Finland'), ('FR', 'FRA', 'France'), ('GF', 'GUF', 'French Guiana'),
+    ('PF', 'PYF', 'French Polynesia'), ('TF', 'ATF', 'French Southern Territories'), ('GA', 'GAB', 'Gabon'),
+    ('GM', 'GMB', 'Gambia'), ('GE', 'GEO', 'Georgia'), ('DE', 'DEU', 'Germany'), ('GH', 'GHA', 'Ghana'),
+    ('GI', 'GIB', 'Gibraltar'), ('GR', 'GRC', 'Greece'), ('GL', 'GRL', 'Greenland'), ('GD', 'GRD', 'Grenada'),
+    ('GP', 'GLP', 'Guadeloupe'), ('GU', 'GUM', 'Guam'), ('GT', 'GTM', 'Guatemala'), ('GG', 'GGY', 'Guernsey'),
+    ('GN', 'GIN', 'Guinea'), ('GW', 'GNB', 'Guinea-Bissau'), ('GY', 'GUY', 'Guyana'), ('HT', 'HTI', 'Haiti'),
+    ('HM', 'HMD', 'Heard Island and McDonald Islands'), ('VA', 'VAT', 'Holy See'), ('HN', 'HND', 'Honduras'),
+    ('HK', 'HKG', 'Hong Kong'), ('HU', 'HUN', 'Hungary'), ('IS', 'ISL', 'Iceland'), ('IN', 'IND', 'India'),
+    ('ID', 'IDN', 'Indonesia'), ('IR', 'IRN', 'Iran'), ('IQ', 'IRQ', 'Iraq'), ('IE', 'IRL', 'Ireland'),
+    ('IM', 'IMN', 'Isle of Man'), ('IL', 'ISR', 'Israel'), ('IT', 'ITA', 'Italy'), ('JM', 'JAM', 'Jamaica'),
+    ('JP', 'JPN', 'Japan'), ('JE', 'JEY', 'Jersey'), ('JO', 'JOR', 'Jordan'), ('KZ', 'KAZ', 'Kazakhstan'),
+    ('KE', 'KEN', 'Kenya'), ('KI', 'KIR', 'Kiribati'), ('KP', 'PRK', 'North Korea'), ('KR', 'KOR', 'South Korea'),
+    ('XK', 'XKX', 'Kosovo'), ('KW', 'KWT', 'Kuwait'), ('KG', 'KGZ', 'Kyrgyzstan'), ('LA', 'LAO', 'Laos'),
+    ('LV', 'LVA', 'Latvia'), ('LB', 'LBN', 'Lebanon'), ('LS', 'LSO', 'Lesotho'), ('LR', 'LBR', 'Liberia'),
+    ('LY', 'LBY', 'Libya'), ('LI', 'LIE', 'Liechtenstein'), ('LT', 'LTU', 'Lithuania'), ('LU', 'LUX', 'Luxembourg'),
+    ('MO', 'MAC', 'Macao'), ('MG', 'MDG', 'Madagascar'), ('MW', 'MWI', 'Malawi'), ('MY', 'MYS', 'Malaysia'),
+    ('MV', 'MDV', 'Maldives'), ('ML', 'MLI', 'Mali'), ('MT', 'MLT', 'Malta'), ('MH', 'MHL', 'Marshall Islands'),
+    ('MQ', 'MTQ', 'Martinique'), ('MR', 'MRT', 'Mauritania'), ('MU', 'MUS', 'Mauritius'), ('YT', 'MYT', 'Mayotte'),
+    ('MX', 'MEX', 'Mexico'), ('FM', 'FSM', 'Micronesia'), ('MD', 'MDA', 'Moldova'), ('MC', 'MCO', 'Monaco'),
+    ('MN', 'MNG', 'Mongolia'), ('ME', 'MNE', 'Montenegro'), ('MS', 'MSR', 'Montserrat'), ('MA', 'MAR', 'Morocco'),
+    ('MZ', 'MOZ', 'Mozambique'), ('MM', 'MMR', 'Myanmar'), ('NA', 'NAM', 'Namibia'), ('NR', 'NRU', 'Nauru'),
+    ('NP', 'NPL', 'Nepal'), ('NL', 'NLD', 'Netherlands'), ('NC', 'NCL', 'New Caledonia'), ('NZ', 'NZL', 'New Zealand'),
+    ('NI', 'NIC', 'Nicaragua'), ('NE', 'NER', 'Niger'), ('NG', 'NGA', 'Nigeria'), ('NU', 'NIU', 'Niue'),
+    ('NF', 'NFK', 'Norfolk Island'), ('MK', 'MKD', 'North Macedonia'), ('MP', 'MNP', 'Northern Mariana Islands'),
+    ('NO', 'NOR', 'Norway'), ('OM', 'OMN', 'Oman'), ('PK', 'PAK', 'Pakistan'), ('PW', 'PLW', 'Palau'),
+    ('PS', 'PSE', 'Palestine'), ('PA', 'PAN', 'Panama'), ('PG', 'PNG', 'Papua New Guinea'), ('PY', 'PRY', 'Paraguay'),
+    ('PE', 'PER', 'Peru'), ('PH', 'PHL', 'Philippines'), ('PN', 'PCN', 'Pitcairn'), ('PL', 'POL', 'Poland'),
+    ('PT', 'PRT', 'Portugal'), ('PR', 'PRI', 'Puerto Rico'), ('QA', 'QAT', 'Qatar'), ('RE', 'REU', 'Réunion'),
+    ('RO', 'ROU', 'Romania'), ('RU', 'RUS', 'Russia'), ('RW', 'RWA', 'Rwanda'), ('BL', 'BLM', 'Saint Barthélemy'),
+    ('SH', 'SHN', 'Saint Helena, Ascension and Tristan da Cunha'), ('KN', 'KNA', 'Saint Kitts and Nevis'),
+    ('LC', 'LCA', 'Saint Lucia'), ('MF', 'MAF', 'Saint Martin'), ('PM', 'SPM', 'Saint Pierre and Miquelon'),
+    ('VC', 'VCT', 'Saint Vincent and the Grenadines'), ('WS', 'WSM', 'Samoa'), ('SM', 'SMR', 'San Marino'),
+    ('ST', 'STP', 'Sao Tome and Principe'), ('SA', 'SAU', 'Saudi Arabia'), ('SN', 'SEN', 'Senegal'), ('RS', 'SRB', 'Serbia'),
+    ('SC', 'SYC', 'Seychelles'), ('SL', 'SLE', 'Sierra Leone'), ('SG', 'SGP', 'Singapore'), ('SX', 'SXM', 'Sint Maarten'),
+    ('SK', 'SVK', 'Slovakia'), ('SI', 'SVN', 'Slovenia'), ('SB', 'SLB', 'Solomon Islands'), ('SO', 'SOM', 'Somalia'),
+    ('ZA', 'ZAF', 'South Africa'), ('GS', 'SGS', 'South Georgia and the South Sandwich Islands'),
+    ('SS', 'SSD', 'South Sudan'), ('ES', 'ESP', 'Spain'), ('LK', 'LKA', 'Sri Lanka'), ('SD', 'SDN', 'Sudan'),
+    ('SR', 'SUR', 'Suriname'), ('SJ', 'SJM', 'Svalbard and Jan Mayen'), ('SE', 'SWE', 'Sweden'), ('CH', 'CHE', 'Switzerland'),
+    ('SY', 'SYR', 'Syria'), ('TW', 'TWN', 'Taiwan'), ('TJ', 'TJK', 'Tajikistan'), ('TZ', 'TZA', 'Tanzania'),
+    ('TH', 'THA', 'Thailand'), ('TL', 'TLS', 'Timor-Leste'), ('TG', 'TGO', 'Togo'), ('TK', 'TKL', 'Tokelau'),
+    ('TO', 'TON', 'Tonga'), ('TT', 'TTO', 'Trinidad and Tobago'), ('TN', 'TUN', 'Tunisia'), ('TR', 'TUR', 'Türkiye'),
+    ('TM', 'TKM', 'Turkmenistan'), ('TC', 'TCA', 'Turks and Caicos Islands'), ('TV', 'TUV', 'Tuvalu'),
+    ('UG', 'UGA', 'Uganda'), ('UA', 'UKR', 'Ukraine'), ('AE', 'ARE', 'United Arab Emirates'), ('GB', 'GBR', 'United Kingdom'),
+    ('US', 'USA', 'United States'), ('UM', 'UMI', 'United States Minor Outlying Islands'), ('UY', 'URY', 'Uruguay'),
+    ('UZ', 'UZB', 'Uzbekistan'), ('VU', 'VUT', 'Vanuatu'), ('VE', 'VEN', 'Venezuela'), ('VN', 'VNM', 'Vietnam'),
+    ('VG', 'VGB', 'British Virgin Islands'), ('VI', 'VIR', 'U.S. Virgin Islands'), ('WF', 'WLF', 'Wallis and Futuna'),
+    ('EH', 'ESH', 'Western Sahara'), ('YE', 'YEM', 'Yemen'), ('ZM', 'ZMB', 'Zambia'), ('ZW', 'ZWE', 'Zimbabwe'),
+]
+
+COUNTRY_NAMES = {alpha3: name for alpha2, alpha3, name in COUNTRIES}
+
+# other names, official names and abbreviations typed into lead forms, written the way normalise_country leaves them
+ALIASES = {
+    'us': 'USA', 'usa': 'USA', 'america': 'USA', 'united states of america': 'USA',
+    'uk': 'GBR', 'great britain': 'GBR', 'britain': 'GBR', 'england': 'GBR', 'scotland': 'GBR', 'wales': 'GBR',
+    'northern ireland': 'GBR', 'united kingdom of great britain and northern ireland': 'GBR',
+    'uae': 'ARE', 'emirates': 'ARE', 'dubai': 'ARE', 'abu dhabi': 'ARE', 'ksa': 'SAU', 'saudi': 'SAU',
+    'bharat': 'IND', 'prc': 'CHN', 'peoples republic of china': 'CHN', 'nz': 'NZL', 'holland': 'NLD',
+    'russian federation': 'RUS', 'korea': 'KOR', 'republic of korea': 'KOR', 'korea republic of': 'KOR',
+    'dprk': 'PRK', 'democratic peoples republic of korea': 'PRK', 'iran islamic republic of': 'IRN',
+    'islamic republic of iran': 'IRN', 'syrian arab republic': 'SYR', 'lao peoples democratic republic': 'LAO',
+    'viet nam': 'VNM', 'bolivia plurinational state of': 'BOL', 'venezuela bolivarian republic of': 'VEN',
+    'tanzania united republic of': 'TZA', 'united republic of tanzania': 'TZA', 'moldova republic of': 'MDA',
+    'republic of moldova': 'MDA', 'czech republic': 'CZE', 'ivory coast': 'CIV', 'cape verde': 'CPV',
+    'swaziland': 'SWZ', 'burma': 'MMR', 'macedonia': 'MKD', 'republic of north macedonia': 'MKD',
+    'taiwan province of china': 'TWN', 'hong kong sar': 'HKG', 'macau': 'MAC', 'state of palestine': 'PSE',
+    'palestinian territories': 'PSE', 'vatican': 'VAT', 'vatican city': 'VAT', 'brunei darussalam': 'BRN',
+    'micronesia federated states of': 'FSM', 'turkey': 'TUR', 'republic of the congo': 'COG', 'congo brazzaville': 'COG',
+    'congo kinshasa': 'COD', 'drc': 'COD', 'dr congo': 'COD', 'democratic republic of congo': 'COD',
+    'congo democratic republic of the': 'COD', 'east timor': 'TLS', 'falkland islands malvinas': 'FLK',
+    'saint helena': 'SHN', 'st helena': 'SHN', 'st kitts and nevis': 'KNA', 'st lucia': 'LCA',
+    'st vincent and the grenadines': 'VCT', 'st barthelemy': 'BLM', 'st martin': 'MAF', 'st maarten': 'SXM',
+    'bonaire': 'BES', 'pitcairn islands': 'PCN', 'us virgin islands': 'VIR', 'virgin islands us': 'VIR',
+    'bvi': 'VGB', 'virgin islands british': 'VGB',
+}
+
+#Function to normalise a country name for lookup: accents dropped, case folded, '&' read as 'and', dots and
+#apostrophes removed (U.S.A. -> usa), other punctuation as spaces and a leading 'the' dropped
+def normalise_country(text):
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().casefold().replace('&', ' and ')
+    text = ' '.join(re.sub(r'[^a-z0-9]+', ' ', re.sub(r"[.'’]", '', text)).split())
+    return text[4:] if text.startswith('the ') else text
+
+_BY_NAME = {normalise_country(name): alpha3 for alpha2, alpha3, name in COUNTRIES} | ALIASES
+# 'NA' is far more often typed for a missing value than for Namibia, so Namibia is only matched by its name or 'NAM'
+_BY_CODE = {code: alpha3 for alpha2, alpha3, name in COUNTRIES for code in (alpha2, alpha3) if code != 'NA'}
+
+#Function to get the ISO-3 code of a free-text country value, None if it matches no country. Upper case ISO-2 and
+#ISO-3 codes ('IN', 'GBR') are accepted as well as names
+@functools.lru_cache(maxsize=4096)
+def country_code(value):
+    value = str(value).strip()
+    if value.isupper() and value in _BY_CODE:
+        return _BY_CODE[value]
+    return _BY_NAME.get(normalise_country(value))
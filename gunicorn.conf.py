@@ -0,0 +1,24 @@
+# gunicorn settings for wsgi.py, every value can be overridden from the environment
+
+import importlib.util
+import multiprocessing
+import os
+
+bind = os.environ.get('SALES_DASH_BIND', '0.0.0.0:8050')
+
+# one process per core for the pandas work, a few threads each so page and chart requests are not queued
+# behind a slow one. Workers find each other's datasets in the parquet file cache, without pyarrow a dataset is only
+# known to the worker that ingested it, so there is one worker unless pyarrow is installed
+shared_datasets = importlib.util.find_spec('pyarrow') is not None
+workers = int(os.environ.get('SALES_DASH_WORKERS', multiprocessing.cpu_count() if shared_datasets else 1))
+if workers > 1 and not shared_datasets:
+    raise RuntimeError(f'{workers} workers need pyarrow installed to share datasets, install it or set SALES_DASH_WORKERS=1')
+threads = int(os.environ.get('SALES_DASH_THREADS', 4))
+worker_class = 'gthread'
+
+# uploads are parsed in the request when diskcache is not installed
+timeout = int(os.environ.get('SALES_DASH_TIMEOUT', 300))
+
+# recycle workers now and then, so memory held by datasets that are no longer looked at goes back to the system
+max_requests = int(os.environ.get('SALES_DASH_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
@@ -1,17 +1,46 @@
 
 # install XlsxWriter
+# install pyarrow (optional, keeps a parquet copy of every ingested file so it is never parsed twice)
+# install diskcache (optional, shares aggregates between processes; with multiprocess and psutil, pip install
+#   "dash[diskcache]", also runs heavy callbacks as background jobs)
+# install gunicorn to serve with several worker processes, see wsgi.py
 
 # ------------------------------------------------------------------------------------------------------------------------------
 
 import dash 
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash import html, dcc, dash_table
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import pandas as pd
+import numpy as np
 import io
+import os
 import base64
 import datetime
+import calendar
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+import argparse
+import flask
+
+from country_codes import COUNTRY_NAMES, country_code
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 
 # ------------------------------------------------------------------------------------------------------------------------------
 # fetch current month
@@ -19,183 +48,1280 @@ def current_month():
     now = datetime.datetime.now()
     return now.strftime('%m')
 # ------------------------------------------------------------------------------------------------------------------------------
+# instrumentation, off unless SALES_DASH_METRICS=1. Records the wall time and payload sizes of every callback request,
+# the time spent in each stage of the data path (decode, parse, filter, aggregate, figure, serialise, ...) and the hit
+# rate of every cache. Callback responses carry their stage timings in a Server-Timing header (shown in the browser's
+# network tab) and the running totals are served in Prometheus text format at /metrics. Heavy callbacks that run as
+# background jobs do their work in another process, so only their request times are seen here
+
+METRICS_ENABLED = os.environ.get('SALES_DASH_METRICS', '').lower() in ('1', 'true', 'yes')
+
+_metrics_lock = threading.Lock()
+_stage_totals = {}          # stage -> [calls, seconds]
+_callback_totals = {}       # callback outputs -> [calls, seconds, request bytes, response bytes]
+_cache_totals = {}          # cache -> [hits, misses]
+
+#Function to add the time of one stage to the totals and to the Server-Timing header of the current request
+def record_stage(stage, seconds):
+    with _metrics_lock:
+        totals = _stage_totals.setdefault(stage, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+    if flask.has_request_context():
+        flask.g.setdefault('stage_timings', []).append((stage, seconds))
+
+#Function to count one lookup of a cache
+def record_cache(cache, hit):
+    if not METRICS_ENABLED:
+        return
+    with _metrics_lock:
+        _cache_totals.setdefault(cache, [0, 0])[0 if hit else 1] += 1
+
+#Context manager timing a stage of the data path, does nothing when instrumentation is off
+@contextlib.contextmanager
+def timed_stage(stage):
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+#Decorator timing every call of a function as a stage, the function is left untouched when instrumentation is off
+def timed(stage):
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+#Function to render the running totals in the Prometheus text exposition format
+def render_metrics():
+    with _metrics_lock:
+        callbacks = {key: list(totals) for key, totals in _callback_totals.items()}
+        stages = {key: list(totals) for key, totals in _stage_totals.items()}
+        caches = {key: list(totals) for key, totals in _cache_totals.items()}
+
+    lines = []
+    def metric(name, help_text, samples):
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+        lines.extend(f'{name}{{{labels}}} {value}' for labels, value in samples)
+
+    for column, (name, help_text) in enumerate([
+            ('sales_dash_callback_calls_total', 'Callback requests served.'),
+            ('sales_dash_callback_seconds_total', 'Wall time spent serving callback requests.'),
+            ('sales_dash_callback_request_bytes_total', 'Bytes received in callback requests.'),
+            ('sales_dash_callback_response_bytes_total', 'Bytes sent in callback responses.')]):
+        metric(name, help_text, [(f'callback="{_metric_label(key)}"', totals[column]) for key, totals in sorted(callbacks.items())])
+    for column, (name, help_text) in enumerate([
+            ('sales_dash_stage_calls_total', 'Runs of each data path stage.'),
+            ('sales_dash_stage_seconds_total', 'Wall time spent in each data path stage.')]):
+        metric(name, help_text, [(f'stage="{_metric_label(key)}"', totals[column]) for key, totals in sorted(stages.items())])
+    metric('sales_dash_cache_lookups_total', 'Cache lookups by result.',
+           [(f'cache="{_metric_label(key)}",result="{result}"', totals[column])
+            for key, totals in sorted(caches.items()) for column, result in enumerate(['hit', 'miss'])])
+    return '\n'.join(lines) + '\n'
+
+#Function to add the Server-Timing headers and the /metrics endpoint to the dash app's flask server
+def install_metrics(server):
+    @server.before_request
+    def start_request_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_callback(response):
+        if not flask.request.path.endswith('/_dash-update-component') or 'request_start' not in flask.g:
+            return response
+        seconds = time.perf_counter() - flask.g.request_start
+        body = flask.request.get_json(silent=True)
+        callback = body.get('output') if isinstance(body, dict) else None
+        if not isinstance(callback, str) or not callback:
+            callback = 'unknown'        # malformed posts, all kept under one name so /metrics can sort them
+        with _metrics_lock:
+            totals = _callback_totals.setdefault(callback, [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += flask.request.content_length or 0
+            totals[3] += response.content_length or 0
+
+        stage_seconds = {}
+        for stage, duration in flask.g.get('stage_timings', []):
+            stage_seconds[stage] = stage_seconds.get(stage, 0) + duration
+        timings = [f'{stage};dur={duration * 1000:.1f}' for stage, duration in stage_seconds.items()]
+        response.headers['Server-Timing'] = ', '.join(timings + [f'callback;dur={seconds * 1000:.1f}'])
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+# ------------------------------------------------------------------------------------------------------------------------------
+
+#Function to decode the base64 string sent by dcc.Upload into the raw file bytes
+@timed('decode')
+def decode_contents(contents):
+    content_type, content_string = contents.split(',')
+    return base64.b64decode(content_string)
 
 #Function to read excel file, decode and convert to dataframe
 def read_file(contents):
     if contents is None:
         return ''
-    content_type, content_string = contents.split(',')
-    
-    decoded = io.BytesIO(base64.b64decode(content_string))
-    df = pd.read_excel(decoded, engine='openpyxl')
-    df.insert(0, 'SNo', range(1, len(df) + 1))
-    df.set_index('Record ID', inplace=True, drop = False)
+    return parse_workbook(decode_contents(contents))
+
+#Function used where no progress is reported. Ingest steps call progress(fraction done, message)
+def no_progress(fraction, message):
+    pass
+
+#Function to convert the raw bytes of an excel file to a dataframe
+@timed('parse')
+def parse_workbook(raw_bytes, progress=no_progress):
+    if len(raw_bytes) >= STREAMING_INGEST_BYTES:
+        # build the frame batch by batch, each batch is normalised and compacted before the next one is read
+        df = apply_schema(pd.concat(iter_workbook_batches(raw_bytes, progress=progress), ignore_index=True))
+    else:
+        progress(0.1, 'Reading the workbook')
+        df = apply_schema(normalise_batch(pd.read_excel(io.BytesIO(raw_bytes), engine='openpyxl')))
+
+    progress(0.8, 'Matching duplicate leads')
+    # kept in Create Date order so every year and month is a contiguous block of rows (see build_partitions)
+    df = df.sort_values('Create Date', kind='mergesort', na_position='last', ignore_index=True)
+    df['Duplicate Cluster'] = duplicate_clusters(df)
+    return derive_features(df)
+
+#Function to clean up a batch of rows read from the excel file, first_row is the SNo of its first row
+def normalise_batch(df, first_row=1):
+    df.insert(0, 'SNo', range(first_row, first_row + len(df)))
     df['Create Date'] = pd.to_datetime(df['Create Date']) 
     df['Year'] = df['Create Date'].dt.year
-    df['Phone Number'] = df['Phone Number'].str.replace(' ', '').str.replace('+', '').str[-10:] #extract last 10 digits after removing extra spaces, to remove any country codes
-    df['Lead Source'].fillna("Facebook", inplace = True)
+    phone_given, age_given = _given(df['Phone Number']), _given(df['Age of your Child'])
+    phone = df['Phone Number'].astype(object)
+    is_text = phone.map(type) == str
+    #drop spaces, '+', dashes and brackets, and keep the last 10 digits to remove any country codes. Cut as text, a
+    #longer digit string (two numbers in one cell) would lose its last digits as a float
+    digits = phone.where(is_text).str.replace(r'\D', '', regex=True).str[-10:]
+    df['Phone Number'] = (pd.to_numeric(phone.mask(is_text, digits), errors='coerce') % 10**10).round()
+    df['Age of your Child'] = pd.to_numeric(df['Age of your Child'], errors='coerce')     # typed ages like 'ten' become NA
+    # counted by the data quality panel
+    df['Phone Number Unparsed'] = phone_given & df['Phone Number'].isna()
+    df['Age of your Child Unparsed'] = age_given & df['Age of your Child'].isna()
+    df['Lead Source Imputed'] = df['Lead Source'].isna()
+    df['Lead Source'] = df['Lead Source'].fillna("Facebook")
 
     # print(df['Year'])
     # print(df.columns)
 
     return df
+
+#Function to find the cells of a column that were filled in, not blank or only spaces
+def _given(values):
+    return values.notna() & (values.astype(str).str.strip() != '')
+
+# flags recorded per lead at ingest for the data quality panel, never shown in the tables or exported. The Unparsed
+# flags mark cells that were filled in but are blank after parsing (a phone number without digits, an age typed as text)
+UNPARSED_FLAGS = {'Phone Number': 'Phone Number Unparsed', 'Age of your Child': 'Age of your Child Unparsed'}
+INGEST_FLAGS = ['Lead Source Imputed'] + list(UNPARSED_FLAGS.values())
+
+#Function to get the columns of a dataset that are shown and exported, all but the INGEST_FLAGS
+def shown_columns(columns):
+    return [col for col in columns if col not in INGEST_FLAGS]
+
+# files at least this large are read in streaming mode, in batches of INGEST_BATCH_ROWS rows
+STREAMING_INGEST_BYTES = int(os.environ.get('SALES_DASH_STREAMING_INGEST_BYTES', 16 * 1024 * 1024))
+INGEST_BATCH_ROWS = 20000
+
+# cell values pd.read_excel reads as missing by default, applied to the streamed batches too so a workbook parses the
+# same whichever way it is read
+NA_STRINGS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+              'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+#Function to build a frame from rows read with openpyxl, with the NA_STRINGS cells missing as in pd.read_excel
+def _batch_frame(batch, columns):
+    df = pd.DataFrame(batch, columns=columns)
+    return df.mask(df.isin(NA_STRINGS))
+
+#Function to read the first sheet of an excel file in batches of normalised, compacted rows with openpyxl's read-only
+#mode, so the whole workbook is never held in memory next to the frame built from it
+def iter_workbook_batches(raw_bytes, batch_rows=INGEST_BATCH_ROWS, progress=no_progress):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(raw_bytes), read_only=True, data_only=True)
+    try:
+        total_rows = workbook.worksheets[0].max_row or 0    # from the sheet's dimension record, 0 if the file has none
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f'Unnamed: {i}' if col is None else col for i, col in enumerate(header)]
+
+        first_row, batch = 1, []
+        for row in rows:
+            if all(value is None for value in row):     # pd.read_excel skips blank rows too
+                continue
+            batch.append(row[:len(columns)])
+            if len(batch) == batch_rows:
+                yield apply_schema(normalise_batch(_batch_frame(batch, columns), first_row))
+                first_row, batch = first_row + len(batch), []
+                progress(0.1 + 0.7 * min(1, first_row / total_rows) if total_rows else 0.1, f'Read {first_row - 1:,} rows')
+        if batch or first_row == 1:
+            yield apply_schema(normalise_batch(_batch_frame(batch, columns), first_row))
+    finally:
+        workbook.close()
+
+CATEGORY_COLUMNS = ['Country/Region', 'Lead Source', 'Contact owner', 'Lead Status']
+
+#Function to give the parsed columns fixed types, so the frame round-trips through the parquet file cache unchanged
+def apply_schema(df):
+    df['SNo'] = df['SNo'].astype('int32')
+    df['Year'] = df['Year'].astype('Int16')
+    df['Phone Number'] = df['Phone Number'].astype('Int64')
+    df['Age of your Child'] = df['Age of your Child'].astype('Float32')
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+    # any other text column may mix strings and numbers, which parquet can't store in one column
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype('string')
+    return df
+
+# age groups of the age chart, ages outside the bins (negative) or not given as a number are left blank
+AGE_BINS = [0, 10, 19, 22, np.inf]
+AGE_GROUPS = ["Ages <= 10", "11 <= Ages <= 19", "20 <= Ages <= 22", "Age > 22"]
+
+#Function to add the columns the charts group by, once at ingest: Month (1-12) and Age Group
+def derive_features(df):
+    df['Month'] = df['Create Date'].dt.month.astype('Int8')
+    df['Age Group'] = pd.cut(df['Age of your Child'].astype('float64'), AGE_BINS, labels=AGE_GROUPS, include_lowest=True)
+    return df
 # ------------------------------------------------------------------------------------------------------------------------------
+# duplicate detection. Leads sharing a normalised phone number or email are grouped into one duplicate cluster with
+# union-find, so a lead matching one record by phone and another by email links all three. Clusters are computed once
+# at ingest into the 'Duplicate Cluster' column (empty for leads without duplicates) and the year view only filters it
 
-app = dash.Dash(__name__, external_stylesheets = [dbc.themes.MORPH])
-
-# ------------------------------------------------------------------------------------------------------------------------------
-
-app.layout = html.Div([
-    html.H1(["Sales Dashboard"], className = "fw-bold", style = {'justify-content':'center', 'display':'flex'}),
-    html.Br(),
-    html.Div(id='upload-container', 
-             className='centered-container', 
-             children=[
-                        dcc.Upload(
-                                    id='upload-data',
-                                    children=html.Div([html.A('Select Data File')], style={'color': 'black'}),
-                                    style={
-                                        'width': '50%',
-                                        'height': '60px',
-                                        'lineHeight': '60px',
-                                        'borderWidth': '1px',
-                                        'borderStyle': 'dashed',
-                                        'borderRadius': '5px',
-                                        'textAlign': 'center',
-                                        'margin': '10px auto', 
-                                        'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)', 
-                                    },
-                                    multiple=False,
-                                ),
-                            ]),                                                                 
-    html.Br(),
-    html.Div([
-        dbc.Row([
-            dbc.Col(
-                dcc.Input(id='year-input',
-                  type='number',
-                  value=2023, 
-                  style={'height': '55px',
-                         'width':'50%',      
-                         'border': 'none',  
-                         'border-radius': '5px',  
-                         'padding': '5px',
-                         'margin-left':'20%',
-                         'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',        
-                    } 
-                ),
-            ),
-            dbc.Col(
-                dbc.Select( 
-            id='month-dropdown',
-            options=[{'label': 'January', 'value': '01'},
-                     {'label': 'February', 'value': '02'},
-                     {'label': 'March', 'value': '03'},
-                     {'label': 'April', 'value': '04'},
-                     {'label': 'May', 'value': '05'},
-                     {'label': 'June', 'value': '06'},
-                     {'label': 'July', 'value': '07'},
-                     {'label': 'August', 'value': '08'},
-                     {'label': 'September', 'value': '09'},
-                     {'label': 'October', 'value': '10'},
-                     {'label': 'November', 'value': '11'},
-                     {'label': 'December', 'value': '12'}
-                ],
-            placeholder='Select a month...',
-            style={'width': '50%', 'margin-right':'20%','box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',},
-            className="px-2 border")
-            )
-        ])
-    ]),
-    html.Br(),
-    html.Br(),
-    dcc.Loading(
-        id="loading-output",
-        type="default",
-        children=[html.Div(id='data-table-component')],
-    ), 
-    html.Br(),
-    html.Div([
-        html.Button("View duplicate records", 
-                    id='view-duplicate-button',
-                    style={ 'border': 'none',            
-                            'padding': '10px 20px',     
-                            'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',  
-                            'border-radius': '5px',
-                        }),
-        dcc.Loading(id="loading-output-1",
-                    type="default",
-                    children=[html.Div(id='view-duplicate-records')],
+MIN_PHONE_DIGITS = 7    # shorter "phone numbers" are junk like '1234' that would link unrelated leads
+
+#Function to pick the phone numbers usable for matching (already digits only, last 10 digits at ingest)
+def phone_key(phone):
+    return phone.where(phone >= 10 ** (MIN_PHONE_DIGITS - 1))
+
+#Function to normalise emails for matching: trimmed, lower case
+def email_key(email):
+    key = email.astype('string').str.strip().str.lower()
+    return key.where(key.str.len() > 0)
+
+#Function to assign every lead the id of its duplicate cluster (numbered from 1), NA for leads with no duplicate
+@timed('duplicates')
+def duplicate_clusters(df):
+    parent = list(range(len(df)))
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for key in (phone_key(df['Phone Number']), email_key(df['Email'])):
+        codes = pd.factorize(key)[0]                        # -1 where the lead has no usable key
+        has_key = np.flatnonzero(codes >= 0)
+        first = pd.Series(has_key).groupby(codes[has_key]).transform('min').to_numpy()
+        # only leads sharing a key with an earlier lead are linked, so the loop runs over the duplicates alone
+        linked = has_key != first
+        for row, first_row in zip(has_key[linked].tolist(), first[linked].tolist()):
+            root, first_root = find(row), find(first_row)
+            if root != first_root:
+                parent[max(root, first_root)] = min(root, first_root)
+
+    roots = np.array(parent, dtype=np.int64)
+    while True:                                             # point every lead straight at its root
+        next_roots = roots[roots]
+        if (next_roots == roots).all():
+            break
+        roots = next_roots
+
+    in_cluster = np.bincount(roots, minlength=len(roots))[roots] > 1
+    clusters = pd.Series(pd.NA, index=df.index, dtype='Int32')
+    clusters.iloc[np.flatnonzero(in_cluster)] = pd.factorize(roots[in_cluster])[0] + 1
+    return clusters
+# ------------------------------------------------------------------------------------------------------------------------------
+# on-disk cache of ingested files. Every parsed file is written once as typed parquet under CACHE_DIR, named by its
+# dataset id, so a re-upload of the same export, an evicted dataset or the ingest CLI below all skip pd.read_excel.
+# Every append writes a whole new merged dataset, so the files are kept under FILE_CACHE_MAX_BYTES by deleting the
+# least recently used ones
+
+CACHE_DIR = os.environ.get('SALES_DASH_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sales_dash_cache'))
+
+CACHE_VERSION = 8       # bump whenever parse_workbook's output changes, so stale files are not picked up
+
+FILE_CACHE_MAX_BYTES = int(os.environ.get('SALES_DASH_FILE_CACHE_BYTES', 10 * 2**30))
+
+def _cache_path(dataset_id):
+    return os.path.join(CACHE_DIR, f'{dataset_id}.v{CACHE_VERSION}.parquet')
+
+#Function to delete the cached files of other CACHE_VERSIONs, and the least recently used files beyond
+#FILE_CACHE_MAX_BYTES except keep (the file just written)
+def _prune_cached_files(keep):
+    current, stale = [], []
+    for entry in os.scandir(CACHE_DIR):
+        if not entry.name.endswith('.parquet'):
+            continue
+        if not entry.name.endswith(f'.v{CACHE_VERSION}.parquet'):
+            stale.append(entry.path)
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:         # deleted by another process meanwhile
+            continue
+        current.append((stat.st_mtime, stat.st_size, entry.path))
+    total = 0
+    for mtime, size, path in sorted(current, reverse=True):     # most recently used first
+        total += size
+        if total > FILE_CACHE_MAX_BYTES and path != keep:
+            stale.append(path)
+    for path in stale:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+#Function to write a parsed dataset to the file cache (skipped when pyarrow is not installed)
+@timed('parquet_write')
+def write_cached_file(dataset_id, df):
+    if pyarrow is None:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (_cache_path(dataset_id), os.getpid())
+    df.to_parquet(tmp_path, engine='pyarrow', index=False)
+    os.replace(tmp_path, _cache_path(dataset_id))     # readers never see a half written file
+    _prune_cached_files(keep=_cache_path(dataset_id))
+
+#Function to load a dataset from the file cache, None if it was never ingested here
+@timed('parquet_read')
+def read_cached_file(dataset_id):
+    if pyarrow is None or not os.path.exists(_cache_path(dataset_id)):
+        return None
+    df = pd.read_parquet(_cache_path(dataset_id), engine='pyarrow', memory_map=True)
+    try:
+        os.utime(_cache_path(dataset_id))       # marks it recently used for _prune_cached_files
+    except OSError:
+        pass
+    return df
+
+#Function to parse the raw bytes of an excel file into the file cache, unless that file was already ingested
+def ingest_bytes(raw_bytes, progress=no_progress):
+    dataset_id = hashlib.sha1(raw_bytes).hexdigest()
+    if pyarrow is not None and os.path.exists(_cache_path(dataset_id)):
+        return dataset_id, None
+    df = parse_workbook(raw_bytes, progress)
+    progress(0.85, 'Saving to the file cache')
+    write_cached_file(dataset_id, df)
+    return dataset_id, df
+
+#Function to pre-ingest every excel export in a folder, so the dashboard opens them without parsing
+def ingest_folder(folder):
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(('.xlsx', '.xlsm')) or name.startswith('~$'):
+            continue
+        with open(os.path.join(folder, name), 'rb') as f:
+            dataset_id, df = ingest_bytes(f.read())
+        print(f"{name}: {dataset_id} ({'already cached' if df is None else 'ingested'})")
+# ------------------------------------------------------------------------------------------------------------------------------
+# server-side store of parsed uploads. The upload is parsed once by ingest_upload and the browser only holds 
+# the dataset id (a hash of the file) in the 'dataset-id' store, which every other callback uses to look the data up.
+# The in-memory store sits in front of the file cache, a dataset that is not in memory is reloaded from there
+
+DATASET_CACHE_MAX_ENTRIES = 4                   # distinct files kept in memory
+DATASET_CACHE_MAX_BYTES = 1024 * 1024 * 1024    # evict least recently used files beyond this total size
+
+_dataset_cache = OrderedDict()                  # dataset id -> (df, size in bytes, derived results), least recently used first
+_dataset_cache_lock = threading.Lock()
+_build_locks = {}                               # dataset id (or (dataset id, key)) -> lock held while it is being built
+
+# derived results (partitions, aggregate cube, figures, view rows) are also written to a diskcache under CACHE_DIR that
+# every process serving the app shares (gunicorn workers, background jobs), so what one process aggregated the others
+# only read back. Without diskcache each process computes its own
+DERIVED_VERSION = 1     # bump whenever a derived result changes (e.g. the cube cells), the parsed files stay valid
+SHARED_CACHE_MAX_BYTES = int(os.environ.get('SALES_DASH_SHARED_CACHE_BYTES', 2 * 1024 * 1024 * 1024))
+_shared_cache = None    # opened on first use
+
+def _get_shared_cache():
+    global _shared_cache
+    if _shared_cache is None and diskcache is not None:
+        _shared_cache = diskcache.Cache(os.path.join(CACHE_DIR, 'derived'), size_limit=SHARED_CACHE_MAX_BYTES)
+    return _shared_cache
+
+def _shared_get(dataset_id, key):
+    shared_cache = _get_shared_cache()
+    return None if shared_cache is None else shared_cache.get((dataset_id, CACHE_VERSION, DERIVED_VERSION, key))
+
+def _shared_set(dataset_id, key, value):
+    shared_cache = _get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.set((dataset_id, CACHE_VERSION, DERIVED_VERSION, key), value)
+
+def _cache_lookup(dataset_id):
+    entry = _dataset_cache.get(dataset_id)
+    if entry is not None:
+        _dataset_cache.move_to_end(dataset_id)
+    return entry
+
+def _cache_store(dataset_id, df):
+    _dataset_cache[dataset_id] = (df, int(df.memory_usage(deep=True).sum()), {})
+    total = sum(size for _, size, _ in _dataset_cache.values())
+    while len(_dataset_cache) > 1 and (len(_dataset_cache) > DATASET_CACHE_MAX_ENTRIES or total > DATASET_CACHE_MAX_BYTES):
+        _, (_, size, _) = _dataset_cache.popitem(last=False)
+        total -= size
+    return _dataset_cache[dataset_id]
+
+#Function to run build() once per lock_key: callbacks that ask for the same result at the same time (every chart on a
+#year change, the same file uploaded from two tabs) wait for the first one instead of repeating its work.
+#find() is called with the cache lock held and returns the result if it already exists, None otherwise. cache names the
+#cache in the hit / miss metrics
+def _build_once(lock_key, find, build, cache):
+    with _dataset_cache_lock:
+        result = find()
+        if result is not None:
+            record_cache(cache, True)
+            return result
+        build_lock = _build_locks.setdefault(lock_key, threading.Lock())
+
+    with build_lock:
+        with _dataset_cache_lock:
+            result = find()
+        record_cache(cache, result is not None)
+        if result is None:
+            result = build()
+        with _dataset_cache_lock:
+            _build_locks.pop(lock_key, None)
+    return result
+
+def _get_entry(dataset_id):
+    if dataset_id is None:
+        return None
+
+    def load():
+        df = read_cached_file(dataset_id)
+        if df is None:
+            return None
+        with _dataset_cache_lock:
+            return _cache_store(dataset_id, df)
+
+    return _build_once(dataset_id, lambda: _cache_lookup(dataset_id), load, 'dataset')
+
+#Function to parse an upload (only the first time that file is seen) and return the id it is stored under
+def ingest_contents(contents, progress=no_progress):
+    progress(0.05, 'Decoding the upload')
+    raw_bytes = decode_contents(contents)
+    dataset_id = hashlib.sha1(raw_bytes).hexdigest()
+
+    def ingest():
+        _, df = ingest_bytes(raw_bytes, progress)
+        if df is None:
+            df = read_cached_file(dataset_id)
+        with _dataset_cache_lock:
+            return _cache_store(dataset_id, df)
+
+    _build_once(dataset_id, lambda: _cache_lookup(dataset_id), ingest, 'dataset')
+    return dataset_id
+
+#Function to fetch a parsed dataframe by its dataset id, None if the id is unknown
+def get_dataset(dataset_id):
+    entry = _get_entry(dataset_id)
+    return None if entry is None else entry[0]
+
+#Function to compute something derived from a dataset once and keep it next to the dataset, None if the id is unknown
+def dataset_memo(dataset_id, key, compute):
+    entry = _get_entry(dataset_id)
+    if entry is None:
+        return None
+    df, _, derived = entry
+
+    def build():
+        result = _shared_get(dataset_id, key)
+        if result is None:
+            result = compute(df)
+            _shared_set(dataset_id, key, result)
+        derived[key] = result
+        return result
+
+    return _build_once((dataset_id, key), lambda: derived.get(key), build, key if isinstance(key, str) else key[0])
+# ------------------------------------------------------------------------------------------------------------------------------
+# partition index. Datasets are sorted by Create Date at ingest, so each year and each (year, month) is one contiguous
+# block of rows. The [start, stop) offsets of every block are found once per dataset and selecting a year or a month
+# is then a slice of the frame instead of a boolean scan and copy of every row
+
+#Function to find the row range of every year and every (year, month) of a dataset sorted by Create Date
+@timed('partition')
+def build_partitions(df):
+    dated_rows = int(df['Create Date'].notna().sum())     # undated leads are sorted last and belong to no partition
+    years = df['Year'].iloc[:dated_rows].to_numpy(dtype=np.int64)
+    year_months = years * 100 + df['Month'].iloc[:dated_rows].to_numpy(dtype=np.int64)
+
+    starts = np.r_[0, np.flatnonzero(np.diff(year_months)) + 1] if dated_rows else np.array([], dtype=np.int64)
+    stops = np.r_[starts[1:], dated_rows]
+    months, years = {}, {}
+    for year_month, start, stop in zip(year_months[starts].tolist(), starts.tolist(), stops.tolist()):
+        year, month = divmod(year_month, 100)
+        months[(year, month)] = (start, stop)
+        years[year] = (years[year][0] if year in years else start, stop)
+    return {'years': years, 'months': months}
+
+#Function to get the rows of a dataset in the selected year (and month, if one is given) as a slice of the frame
+def select_rows(dataset_id, selected_year, selected_month=None):
+    df = get_dataset(dataset_id)
+    if df is None:
+        return None
+    partitions = dataset_memo(dataset_id, 'partitions', build_partitions)
+    if selected_month:
+        start, stop = partitions['months'].get((selected_year, int(selected_month)), (0, 0))
+    else:
+        start, stop = partitions['years'].get(selected_year, (0, 0))
+    return df.iloc[start:stop]
+# ------------------------------------------------------------------------------------------------------------------------------
+# aggregation stage shared by all the charts. Every categorical count and missing count the charts need is computed
+# once per dataset for each (year, month) block of rows and kept in a small aggregate cube; the numbers for a year or
+# a month are then sums over cached cells and the chart callbacks only build figures from them. The cells also hold
+# the data quality profile (missing, malformed and imputed values of every column) shown in the data quality panel
+
+AGGREGATE_COLUMNS = ['Country/Region', 'Lead Source', 'Contact owner', 'Lead Status', 'Month', 'Age Group']
+# added at ingest, not part of the uploaded file, so left out of the data quality panel
+DERIVED_COLUMNS = ['SNo', 'Year', 'Month', 'Age Group', 'Duplicate Cluster'] + INGEST_FLAGS
+MALFORMED_COLUMNS = ['Country/Region', 'Phone Number', 'Email', 'Age of your Child']     # see malformed_counts
+IMPUTED_COLUMNS = ['Lead Source']
+EMAIL_PATTERN = r'[^@\s]+@[^@\s]+\.[^@\s]+'
+
+#Function to count the values of rows that are given but unusable: phone numbers without digits or too short to be
+#real, emails that are not an address, ages typed as text or falling in no age group (negative) and countries matching
+#no country code. country_counts are the lead counts per Country/Region of the rows
+def malformed_counts(rows, country_counts):
+    phone, email = rows['Phone Number'], rows['Email']
+    is_address = email_key(email).str.fullmatch(EMAIL_PATTERN).fillna(False)
+    return {
+        'Country/Region': int(country_counts[country_counts.index.map(country_code).isna()].sum()),
+        'Phone Number': int((phone.notna() & phone_key(phone).isna()).sum() + rows['Phone Number Unparsed'].sum()),
+        'Email': int((email.notna() & ~is_address).sum()),
+        'Age of your Child': int((rows['Age of your Child'].notna() & rows['Age Group'].isna()).sum()
+                                 + rows['Age of your Child Unparsed'].sum()),
+    }
+
+#Function to get the columns of a dataset profiled for missing values: the uploaded ones and the charted ones.
+#Duplicate Cluster is left out, it depends on the whole dataset and can't be counted per cell
+def profiled_columns(columns):
+    return [col for col in columns if col not in DERIVED_COLUMNS or col in AGGREGATE_COLUMNS]
+
+#Function to compute one cell of the cube: the lead counts per category, the missing counts of every column and the
+#malformed and imputed value counts
+def aggregate_rows(rows):
+    counts = {col: rows[col].value_counts() for col in AGGREGATE_COLUMNS}
+    counts['Month'] = counts['Month'].rename(index=dict(enumerate(calendar.month_name)))
+    missing = {col: int(count) for col, count in rows[profiled_columns(rows.columns)].isna().sum().items()}
+    for col, flag in UNPARSED_FLAGS.items():
+        missing[col] -= int(rows[flag].sum())       # blank after parsing but filled in, counted as malformed
+    imputed = {'Lead Source': int(rows['Lead Source Imputed'].sum())}
+    return {'counts': counts, 'missing': missing, 'malformed': malformed_counts(rows, counts['Country/Region']), 'imputed': imputed}
+
+#Function to add up one kind of per-column count over cells of the cube
+def _sum_cells(cells, kind):
+    total = {}
+    for cell in cells:
+        for col, count in cell[kind].items():
+            total[col] = total.get(col, 0) + count
+    return total
+
+#Function to build the aggregate cube of a dataset, one cell per (year, month)
+@timed('aggregate')
+def build_cube(df):
+    partitions = build_partitions(df)
+    return {(year, month): aggregate_rows(df.iloc[start:stop]) for (year, month), (start, stop) in partitions['months'].items()}
+
+#Function to add up cells of the cube into the counts shown by the charts, columns are the columns of the dataset
+@timed('combine')
+def combine_cells(cells, columns):
+    counts = {}
+    for col in AGGREGATE_COLUMNS:
+        col_counts = pd.concat([cell['counts'][col] for cell in cells]) if cells else pd.Series(dtype='int64')
+        col_counts = col_counts.groupby(level=0, observed=True, sort=False).sum()
+        col_counts = col_counts[col_counts > 0].sort_values(ascending=False, kind='mergesort').reset_index()   # categoricals also count absent categories
+        col_counts.columns = [col, 'Lead Count']
+        counts[col] = col_counts
+    # every count starts at 0, so a period without leads (no cells) still has all of them
+    totals = {}
+    for kind, kind_columns in [('missing', profiled_columns(columns)), ('malformed', MALFORMED_COLUMNS), ('imputed', IMPUTED_COLUMNS)]:
+        totals[kind] = dict.fromkeys(kind_columns, 0)
+        totals[kind].update(_sum_cells(cells, kind))
+    return {'counts': counts, **totals}
+
+#Function to get the data quality table of period aggregates: one row per uploaded column with its missing,
+#malformed and imputed value counts
+def quality_rows(aggregates):
+    columns = [col for col in aggregates['missing'] if col not in DERIVED_COLUMNS]
+    return [{'Column': col,
+             'Missing': aggregates['missing'][col],
+             'Malformed': aggregates['malformed'].get(col, 0),
+             'Imputed': aggregates['imputed'].get(col, 0)} for col in columns]
+
+#Function to fetch the chart aggregates of a dataset for the selected year, or only the selected month of it
+def period_aggregates(dataset_id, selected_year, selected_month=None):
+    cube = dataset_memo(dataset_id, 'cube', build_cube)
+    if cube is None:
+        return None
+    if selected_month:
+        cells = [cube[key] for key in [(selected_year, int(selected_month))] if key in cube]
+    else:
+        cells = [cell for (year, month), cell in cube.items() if year == selected_year]
+    return dataset_memo(dataset_id, ('aggregates', selected_year, selected_month or None), lambda df: combine_cells(cells, df.columns))
+
+#Function to answer a chart callback. The figure of every (dataset, year, month, chart) is built once with
+#build_figure and kept as plotly JSON; a newly loaded dataset gets the whole figure, while a year or month change only
+#sends the new traces as a Patch, so the browser keeps the layout (and the map's geo settings) it already has
+def chart_figure(dataset_id, selected_year, selected_month, chart, build_figure):
+    def build(df):
+        with timed_stage('figure'):
+            return build_figure().to_dict()
+
+    figure = dataset_memo(dataset_id, ('figure', chart, selected_year, selected_month or None), build)
+    if dash.ctx.triggered_id in ('year-input', 'month-dropdown'):
+        patch = dash.Patch()
+        patch['data'] = figure['data']
+        return patch
+    return figure
+# ------------------------------------------------------------------------------------------------------------------------------
+# daily rollup behind the trend chart: lead counts per (day, Lead Source, Contact owner), built once per dataset at
+# ingest. A trend over any number of years reads these few thousand rows and resamples them to weeks or months,
+# never the lead table
+
+TREND_BREAKDOWNS = ['Lead Source', 'Contact owner']
+TREND_PERIODS = {'day': 'D', 'week': 'W', 'month': 'M'}     # weeks start on Monday
+
+#Function to build the daily rollup of a dataset, leads without a contact owner are counted under 'Unknown'
+def build_daily_rollup(df):
+    dated = df[df['Create Date'].notna().to_numpy()]
+    keys = [dated['Create Date'].dt.normalize().rename('Date')] + [dated[col].astype(object).fillna('Unknown') for col in TREND_BREAKDOWNS]
+    return dated.groupby(keys).size().rename('Lead Count').reset_index()
+
+#Function to count the leads of the selected year (or month of it, or every year if selected_year is None) per day,
+#week or month, broken down by one of TREND_BREAKDOWNS (any other breakdown gives the totals)
+def trend_counts(dataset_id, selected_year, selected_month, granularity, breakdown):
+    rollup = dataset_memo(dataset_id, 'daily', build_daily_rollup)
+    if rollup is None:
+        return None
+    if selected_year is not None:
+        in_period = rollup['Date'].dt.year == selected_year
+        if selected_month:
+            in_period &= rollup['Date'].dt.month == int(selected_month)
+        rollup = rollup[in_period.to_numpy()]
+    keys = [rollup['Date'].dt.to_period(TREND_PERIODS[granularity]).dt.start_time.rename('Date')]
+    if breakdown in TREND_BREAKDOWNS:
+        keys.append(rollup[breakdown])
+    return rollup.groupby(keys)['Lead Count'].sum().reset_index()
+# ------------------------------------------------------------------------------------------------------------------------------
+# country map. The free-text Country/Region values of a dataset are mapped to ISO-3 codes once (see country_codes.py),
+# the map is drawn from the lead counts per code, so spellings of one country are added up and values matching no
+# country are listed under the map instead of being dropped by plotly
+
+#Function to build the country lookup of a dataset: the ISO-3 code of every Country/Region value, None if unmatched
+def build_country_lookup(df):
+    return {value: country_code(value) for value in df['Country/Region'].cat.categories}
+
+#Function to add up the Country/Region lead counts of a period by ISO-3 code. Returns the counts per code and the
+#counts of the values matching no country
+def country_code_counts(dataset_id, country_counts):
+    lookup = dataset_memo(dataset_id, 'countries', build_country_lookup)
+    codes = country_counts['Country/Region'].astype(object).map(lookup)
+    code_counts = country_counts.groupby(codes.rename('ISO-3'))['Lead Count'].sum().reset_index()
+    code_counts['Country'] = code_counts['ISO-3'].map(COUNTRY_NAMES)
+    return code_counts, country_counts[codes.isna().to_numpy()]
+# ------------------------------------------------------------------------------------------------------------------------------
+# incremental append. Several exports (e.g. one per week) can be uploaded at once or on top of the loaded dataset. Each
+# file is parsed once into the file cache as usual; the merged dataset keeps one row per Record ID (the row from the
+# newest file wins) and is stored under an id made of the ids it was merged from. Only the (year, month) cells of the
+# aggregate cube that gain or lose leads are aggregated again, the others are taken over from the base dataset's cube
+
+#Function to get the (year, month) cells of the cube the given rows fall in
+def _cube_cells(rows):
+    cells = rows[['Year', 'Month']].dropna().drop_duplicates()
+    return set(zip(cells['Year'].astype(int), cells['Month'].astype(int)))
+
+#Function to give the category columns of several frames the same categories, so concatenating them keeps the dtype.
+#The categories are sorted like those of a single file, which sorting and filtering the tables rely on
+def _align_categories(frames):
+    frames = [frame.copy(deep=False) for frame in frames]
+    for col in CATEGORY_COLUMNS:
+        categories = pd.api.types.union_categoricals([frame[col] for frame in frames], sort_categories=True, ignore_order=True).categories
+        for frame in frames:
+            frame[col] = frame[col].cat.set_categories(categories)
+    return frames
+
+#Function to merge the given file datasets, in upload order, into the dataset base_id (None to start a new one) and
+#return the merged dataset's id
+def merge_datasets(base_id, file_ids, progress=no_progress):
+    merged_id = hashlib.sha1(' '.join([base_id or ''] + list(file_ids)).encode()).hexdigest()
+    if _get_entry(merged_id) is not None:       # merged before, still in memory or in the file cache
+        return merged_id
+
+    def merge():
+        progress(0.8, 'Merging')
+        delta = pd.concat(_align_categories([get_dataset(file_id) for file_id in file_ids]), ignore_index=True)
+        delta = delta[~(delta['Record ID'].duplicated(keep='last') & delta['Record ID'].notna()).to_numpy()]
+
+        frames, base_cube, dirty = [delta], {}, _cube_cells(delta)
+        if base_id is not None:
+            base = get_dataset(base_id)
+            replaced = base['Record ID'].isin(delta['Record ID'].dropna()).to_numpy()
+            dirty |= _cube_cells(base[replaced])
+            frames.insert(0, base[~replaced])
+            base_cube = dataset_memo(base_id, 'cube', build_cube)
+
+        df = pd.concat(_align_categories(frames), ignore_index=True)
+        df['SNo'] = np.arange(1, len(df) + 1, dtype='int32')       # renumbered in upload order
+        df = df.sort_values('Create Date', kind='mergesort', na_position='last', ignore_index=True)
+        df['Duplicate Cluster'] = duplicate_clusters(df)             # a new lead can link leads of earlier files
+
+        progress(0.9, 'Aggregating')
+        partitions = build_partitions(df)
+        cube = {cell: base_cube[cell] if cell in base_cube and cell not in dirty else aggregate_rows(df.iloc[start:stop])
+                for cell, (start, stop) in partitions['months'].items()}
+        write_cached_file(merged_id, df)
+        with _dataset_cache_lock:
+            entry = _cache_store(merged_id, df)
+        entry[2].update(partitions=partitions, cube=cube)
+        _shared_set(merged_id, 'partitions', partitions)
+        _shared_set(merged_id, 'cube', cube)
+        return entry
+
+    _build_once(merged_id, lambda: _cache_lookup(merged_id), merge, 'dataset')
+    return merged_id
+
+#Function to ingest one or more uploads and return the id of the dataset to show: the single file uploaded, or the
+#files merged into each other and into base_id, when given
+def ingest_uploads(contents_list, base_id=None, progress=no_progress):
+    file_ids = []
+    for number, contents in enumerate(contents_list):
+        file_progress = lambda fraction, message, number=number: progress(
+            0.8 * (number + fraction) / len(contents_list), f'File {number + 1} of {len(contents_list)}: {message}')
+        file_ids.append(ingest_contents(contents, file_progress))
+    if base_id is not None and get_dataset(base_id) is None:
+        base_id = None          # the loaded dataset is gone (e.g. the file cache was cleared), start a new one
+    if file_ids == [base_id] or (base_id is None and len(file_ids) == 1):
+        return file_ids[0]
+    return merge_datasets(base_id, file_ids, progress)
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# table views served page by page. The DataTables run with custom paging, filtering and sorting, so the browser
+# only ever receives the current page and the filter_query / sort_by it sends are applied here with pandas
+
+#Function to get the records of a year that have a duplicate in the same year, grouped by duplicate cluster
+def duplicate_rows(df):
+    clustered = df[df['Duplicate Cluster'].notna().to_numpy()]
+    cluster_sizes = clustered['Duplicate Cluster'].map(clustered['Duplicate Cluster'].value_counts())
+    duplicates = clustered[(cluster_sizes > 1).to_numpy(dtype=bool)]
+    return duplicates.sort_values(['Duplicate Cluster', 'SNo'], kind='mergesort')
+
+#Function to get the records of a year with no contact owner
+def missing_contact_owner_rows(df):
+    return df[df['Contact owner'].isna()]
+
+TABLE_VIEWS = {
+    'duplicates': duplicate_rows,
+    'missing-owner': missing_contact_owner_rows,
+}
+
+#Function to get the rows of a table view for the selected year and month. The whole period is a slice of the dataset, for the
+#other views only the row positions are cached, not a copy of the rows
+def get_view(dataset_id, view, selected_year, selected_month=None):
+    rows = select_rows(dataset_id, selected_year, selected_month)
+    if rows is None or view == 'year':
+        return rows
+    positions = dataset_memo(dataset_id, ('view', view, selected_year, selected_month or None),
+                             lambda df: TABLE_VIEWS[view](rows).index.to_numpy())
+    return get_dataset(dataset_id).take(positions)
+
+FILTER_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+FILTER_PART = re.compile(r"^\{(?P<column>[^}]*)\}\s*(?P<operator>is blank|is not blank|[si]?(?:contains|datestartswith|eq|ne|lt|le|gt|ge|!=|<=|>=|=|<|>))\s*(?P<value>.*)$")
+
+#Function to split one clause of a DataTable filter_query, e.g. {Lead Source} scontains "Face", into (column, operator, value)
+def split_filter_part(filter_part):
+    match = FILTER_PART.match(filter_part.strip())
+    if match is None:
+        return None, None, None
+    value = match.group('value').strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    return match.group('column'), match.group('operator'), value
+
+#Function to build the boolean mask of one filter clause over a column
+def filter_mask(series, operator, value):
+    if operator == 'is blank':
+        return series.isna()
+    if operator == 'is not blank':
+        return series.notna()
+
+    # s / i prefixes mark case sensitive / insensitive variants of an operator
+    case_sensitive = not operator.startswith('i')
+    if operator[0] in 'si':
+        operator = operator[1:]
+    operator = FILTER_OPERATORS.get(operator, operator)
+
+    if operator == 'contains':
+        return series.astype('string').str.contains(value, case=case_sensitive, regex=False).fillna(False).astype(bool)
+    if operator == 'datestartswith':
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.dt.strftime('%Y-%m-%dT%H:%M:%S')
+        return series.astype('string').str.startswith(value).fillna(False).astype(bool)
+
+    # compare as numbers / dates where the column is one, as text otherwise
+    if pd.api.types.is_numeric_dtype(series):
+        value = pd.to_numeric(value, errors='coerce')
+        if pd.isna(value):
+            return pd.Series(False, index=series.index)
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        value = pd.to_datetime(value, errors='coerce')
+        if pd.isna(value):
+            return pd.Series(False, index=series.index)
+    else:
+        series = series.astype('string')
+        if not case_sensitive:
+            series, value = series.str.lower(), value.lower()
+
+    if operator == '=':
+        mask = series == value
+    elif operator == '!=':
+        mask = series != value
+    elif operator == '<':
+        mask = series < value
+    elif operator == '<=':
+        mask = series <= value
+    elif operator == '>':
+        mask = series > value
+    else:
+        mask = series >= value
+    return mask.fillna(False).astype(bool)
+
+#Function to apply a DataTable filter_query to a dataframe
+@timed('filter')
+def apply_filter_query(df, filter_query):
+    if not filter_query:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for filter_part in filter_query.split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df.columns:
+            continue
+        mask &= filter_mask(df[column], operator, value)
+    return df[mask]
+
+#Function to apply a DataTable sort_by to a dataframe
+@timed('sort')
+def apply_sort_by(df, sort_by):
+    sort_by = [col for col in (sort_by or []) if col['column_id'] in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values([col['column_id'] for col in sort_by],
+                          ascending=[col['direction'] == 'asc' for col in sort_by],
+                          kind='mergesort', na_position='last')
+
+#Function to get one page of a table view after the table's filter and sort, with the resulting number of pages
+def page_view(dataset_id, view, selected_year, selected_month, page_current, page_size, sort_by, filter_query):
+    df = get_view(dataset_id, view, selected_year, selected_month)
+    if df is None:
+        return None, None
+    df = apply_sort_by(apply_filter_query(df, filter_query), sort_by)
+    page_current, page_size = page_current or 0, page_size or 10
+    page_count = max(1, math.ceil(len(df) / page_size))
+    start = page_current * page_size
+    with timed_stage('serialise'):
+        records = df.iloc[start:start + page_size][shown_columns(df.columns)].to_dict('records')
+    return records, page_count
+# ------------------------------------------------------------------------------------------------------------------------------
+# exports. A table view (whole period, duplicates, missing contact owner) is written to xlsx or csv in chunks of rows
+# and kept under CACHE_DIR/exports, named by (dataset id, view, year, month), so downloading it again is just a file read
+
+EXPORT_DIR = os.path.join(CACHE_DIR, 'exports')
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_CACHE_MAX_FILES = 50     # oldest exports are deleted beyond this
+
+EXPORT_VIEWS = {
+    'year': 'records',
+    'duplicates': 'duplicate_records',
+    'missing-owner': 'missing_contact_owner_records',
+}
+
+#Function to write a dataframe to xlsx with xlsxwriter's constant_memory mode, which flushes every row to disk once the
+#next one is started (pandas' to_excel writes column by column, so it can't be used in that mode)
+@timed('export')
+def write_xlsx(df, path, progress=no_progress, columns=None):
+    import xlsxwriter
+
+    columns = list(df.columns) if columns is None else columns
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True,
+                                          'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+                                          'nan_inf_to_errors': True})
+    try:
+        worksheet = workbook.add_worksheet('sheet1')
+        worksheet.write_row(0, 0, [str(col) for col in columns])
+        for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS][columns].astype(object)
+            chunk = chunk.where(chunk.notna(), None)       # blank cells for NaN / NaT / NA
+            for row_number, row in enumerate(chunk.itertuples(index=False, name=None), start=start + 1):
+                worksheet.write_row(row_number, 0, row)
+            progress((start + len(chunk)) / len(df), f'Written {start + len(chunk):,} of {len(df):,} rows')
+    finally:
+        workbook.close()
+
+#Function to write a dataframe to csv in chunks of rows
+@timed('export')
+def write_csv(df, path, progress=no_progress, columns=None):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+            df.iloc[start:start + EXPORT_CHUNK_ROWS].to_csv(f, columns=columns, index=False, header=(start == 0))
+            progress(min(1, (start + EXPORT_CHUNK_ROWS) / max(len(df), 1)), f'Written {min(len(df), start + EXPORT_CHUNK_ROWS):,} of {len(df):,} rows')
+
+def _prune_exports():
+    exports = sorted((entry for entry in os.scandir(EXPORT_DIR) if entry.name.endswith(('.xlsx', '.csv'))),
+                     key=lambda entry: entry.stat().st_mtime)
+    for entry in exports[:-EXPORT_CACHE_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+#Function to get the path of a table view exported as 'xlsx' or 'csv', writing the file only the first time it is asked for.
+#None if the dataset id is unknown
+def export_view(dataset_id, view, selected_year, selected_month, file_format, progress=no_progress):
+    if dataset_id is None:
+        return None
+    path = os.path.join(EXPORT_DIR, f"{dataset_id}.v{CACHE_VERSION}-{view}-{selected_year}-{selected_month or 'all'}.{file_format}")
+
+    def export():
+        df = get_view(dataset_id, view, selected_year, selected_month)
+        if df is None:
+            return None
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        (write_csv if file_format == 'csv' else write_xlsx)(df, tmp_path, progress, columns=shown_columns(df.columns))
+        os.replace(tmp_path, path)
+        _prune_exports()
+        return path
+
+    return _build_once(('export', path), lambda: path if os.path.exists(path) else None, export, 'export')
+
+#Function to name a downloaded export after its view and period
+def export_filename(view, selected_year, selected_month, file_format):
+    period = f'{selected_year}_{calendar.month_name[int(selected_month)]}' if selected_month else f'{selected_year}'
+    return f'{EXPORT_VIEWS[view]}_{period}.{file_format}'
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# app factory. Importing this module only records the layout and callbacks below; create_app (at the end of the file)
+# builds a dash app from them, so the ingest CLI, the benchmarks or a script using the data functions never build the
+# app, its layout or its background job manager. The module level `app` is created on first use
+
+_callbacks = []         # (dependencies, keyword arguments, function) of every callback, in definition order
+
+#Function to record a callback to register on every app create_app builds, takes the same arguments as app.callback
+def callback(*dependencies, **kwargs):
+    def decorator(func):
+        _callbacks.append((dependencies, kwargs, func))
+        return func
+    return decorator
+
+# ------------------------------------------------------------------------------------------------------------------------------
+
+#Function to build the page layout
+def build_layout():
+    return html.Div([
+        html.H1(["Sales Dashboard"], className = "fw-bold", style = {'justify-content':'center', 'display':'flex'}),
+        html.Br(),
+        html.Div(id='upload-container', 
+                 className='centered-container', 
+                 children=[
+                            dcc.Upload(
+                                        id='upload-data',
+                                        children=html.Div([html.A('Select Data Files')], style={'color': 'black'}),
+                                        style={
+                                            'width': '50%',
+                                            'height': '60px',
+                                            'lineHeight': '60px',
+                                            'borderWidth': '1px',
+                                            'borderStyle': 'dashed',
+                                            'borderRadius': '5px',
+                                            'textAlign': 'center',
+                                            'margin': '10px auto', 
+                                            'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)', 
+                                        },
+                                        multiple=True,
+                                    ),
+                                    dbc.Switch(id='append-upload', value=True,
+                                               label='Add uploads to the loaded data (leads are matched on Record ID)',
+                                               style={'width': '50%', 'margin': '0 auto'}),
+                                ]),                                                                 
+        dcc.Store(id='dataset-id'),             # id of the parsed upload held on the server
+        dbc.Progress(id='ingest-progress', value=0, label='', striped=True, style={'width': '50%', 'margin': '0 auto'}),
+        html.Br(),
+        html.Div([
+            dbc.Row([
+                dbc.Col(
+                    dcc.Input(id='year-input',
+                      type='number',
+                      value=2023, 
+                      style={'height': '55px',
+                             'width':'50%',      
+                             'border': 'none',  
+                             'border-radius': '5px',  
+                             'padding': '5px',
+                             'margin-left':'20%',
+                             'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',        
+                        } 
+                    ),
                 ),
+                dbc.Col(
+                    dbc.Select( 
+                id='month-dropdown',
+                options=[{'label': 'All months', 'value': ''},
+                         {'label': 'January', 'value': '01'},
+                         {'label': 'February', 'value': '02'},
+                         {'label': 'March', 'value': '03'},
+                         {'label': 'April', 'value': '04'},
+                         {'label': 'May', 'value': '05'},
+                         {'label': 'June', 'value': '06'},
+                         {'label': 'July', 'value': '07'},
+                         {'label': 'August', 'value': '08'},
+                         {'label': 'September', 'value': '09'},
+                         {'label': 'October', 'value': '10'},
+                         {'label': 'November', 'value': '11'},
+                         {'label': 'December', 'value': '12'}
+                    ],
+                placeholder='Select a month...',
+                style={'width': '50%', 'margin-right':'20%','box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',},
+                className="px-2 border")
+                )
+            ])
         ]),
-    html.Br(),
-    html.Br(),
-    html.Div([
-        html.Button("Download missing Contact Owner records", 
-                    id='download-missing-contact-owner-button',
-                    style={ 'border': 'none',            
-                            'padding': '10px 20px',     
-                            'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',  
-                            'border-radius': '5px',
-                        }
-                ),
+        html.Br(),
+        html.Br(),
+        html.Div(id='data-table-progress'),
         dcc.Loading(
-        id="loading-output-2",
-        type="default",
-        children=[html.Div(id='view-missing-contact-owner-records')],
-    ),
-        dcc.Download(id='download-missing-contact-owner-records'),
-        ]),
-    html.Br(),
-    html.Br(),
-    html.Div(id='bar-container'),
-    dcc.Graph(id='country-map'),
-    html.Div([
-        html.Div([
-            dcc.Graph(id = 'country-pie-chart'),
-            html.Div(id='missing-country-count')], style = {'background':'black'}),
+            id="loading-output",
+            type="default",
+            children=[html.Div(id='data-table-component')],
+        ), 
         html.Br(),
         html.Div([
-            dcc.Graph(id = 'lead-source-pie-chart'),
-            html.Div(id='missing-leadsource-count')], style = {'background':'black'}),
+            html.Button("View duplicate records", 
+                        id='view-duplicate-button',
+                        style={ 'border': 'none',            
+                                'padding': '10px 20px',     
+                                'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',  
+                                'border-radius': '5px',
+                            }),
+            html.Div(id='duplicate-records-progress'),
+            dcc.Loading(id="loading-output-1",
+                        type="default",
+                        children=[html.Div(id='view-duplicate-records')],
+                    ),
+            ]),
+        html.Br(),
         html.Br(),
         html.Div([
-            dcc.Graph(id = 'contact-owner-pie-chart'),
-            html.Div(id='missing-contactowner-count')], style = {'background':'black'}),
+            html.Button("Download missing Contact Owner records", 
+                        id='download-missing-contact-owner-button',
+                        style={ 'border': 'none',            
+                                'padding': '10px 20px',     
+                                'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',  
+                                'border-radius': '5px',
+                            }
+                    ),
+            html.Div(id='missing-contact-owner-progress'),
+            dcc.Loading(
+            id="loading-output-2",
+            type="default",
+            children=[html.Div(id='view-missing-contact-owner-records')],
+        ),
+            dcc.Download(id='download-missing-contact-owner-records'),
+            ]),
+        html.Br(),
         html.Br(),
         html.Div([
-            dcc.Graph(id = 'lead-status-pie-chart'),
-            html.Div(id='missing-leadstatus-count')], style = {'background':'black'}),
+            dbc.Row([
+                dbc.Col(
+                    dbc.Select(id='export-view',
+                               options=[{'label': 'All records', 'value': 'year'},
+                                        {'label': 'Duplicate records', 'value': 'duplicates'},
+                                        {'label': 'Missing Contact Owner records', 'value': 'missing-owner'}],
+                               value='year',
+                               style={'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)'},
+                               className="px-2 border"),
+                ),
+                dbc.Col(
+                    dbc.Select(id='export-format',
+                               options=[{'label': 'Excel (.xlsx)', 'value': 'xlsx'},
+                                        {'label': 'CSV (.csv)', 'value': 'csv'}],
+                               value='xlsx',
+                               style={'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)'},
+                               className="px-2 border"),
+                ),
+                dbc.Col(
+                    html.Button("Export records", 
+                                id='export-button',
+                                style={ 'border': 'none',            
+                                        'padding': '10px 20px',     
+                                        'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)',  
+                                        'border-radius': '5px',
+                                    }),
+                ),
+            ]),
+            html.Div(id='export-progress'),
+            dcc.Download(id='export-download'),
+            ]),
         html.Br(),
-        dcc.Graph(id = 'month-pie-chart'),
         html.Br(),
+        html.Div(id='bar-container'),
+        dcc.Graph(id='country-map'),
+        html.Div(id='unmatched-countries'),
         html.Div([
-            dcc.Graph(id = 'age-pie-chart'),
-            html.Div(id='inconsistent-values')]),
-        ]),
+            html.Div([
+                dcc.Graph(id = 'country-pie-chart'),
+                html.Div(id='missing-country-count')], style = {'background':'black'}),
+            html.Br(),
+            html.Div([
+                dcc.Graph(id = 'lead-source-pie-chart'),
+                html.Div(id='missing-leadsource-count')], style = {'background':'black'}),
+            html.Br(),
+            html.Div([
+                dcc.Graph(id = 'contact-owner-pie-chart'),
+                html.Div(id='missing-contactowner-count')], style = {'background':'black'}),
+            html.Br(),
+            html.Div([
+                dcc.Graph(id = 'lead-status-pie-chart'),
+                html.Div(id='missing-leadstatus-count')], style = {'background':'black'}),
+            html.Br(),
+            dcc.Graph(id = 'month-pie-chart'),
+            html.Br(),
+            html.Div([
+                dbc.Row([
+                    dbc.Col(
+                        dbc.Select(id='trend-granularity',
+                                   options=[{'label': 'Leads per day', 'value': 'day'},
+                                            {'label': 'Leads per week', 'value': 'week'},
+                                            {'label': 'Leads per month', 'value': 'month'}],
+                                   value='week',
+                                   style={'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)'},
+                                   className="px-2 border"),
+                    ),
+                    dbc.Col(
+                        dbc.Select(id='trend-breakdown',
+                                   options=[{'label': 'All leads', 'value': 'none'},
+                                            {'label': 'By Lead Source', 'value': 'Lead Source'},
+                                            {'label': 'By Contact owner', 'value': 'Contact owner'}],
+                                   value='Lead Source',
+                                   style={'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)'},
+                                   className="px-2 border"),
+                    ),
+                    dbc.Col(
+                        dbc.Select(id='trend-range',
+                                   options=[{'label': 'Selected year / month', 'value': 'period'},
+                                            {'label': 'All years', 'value': 'all'}],
+                                   value='period',
+                                   style={'box-shadow': '2px 2px 5px 0px rgba(0, 0, 0, 0.3)'},
+                                   className="px-2 border"),
+                    ),
+                ]),
+                dcc.Graph(id='trend-chart'),
+                ]),
+            html.Br(),
+            html.Div([
+                dcc.Graph(id = 'age-pie-chart'),
+                html.Div(id='inconsistent-values')]),
+            html.Br(),
+            html.Div([
+                html.H4("Data Quality"),
+                dash_table.DataTable(id='data-quality-table',
+                                     columns=[{'name': col, 'id': col} for col in ['Column', 'Missing', 'Malformed', 'Imputed']],
+                                     data=[],
+                                     style_cell={'color': 'black'}),
+                ]),
+            ]),
         
-],style={'height': '200vh',  
-        'color': 'white',  
-        'padding': '30px',
-    })
+    ],style={'height': '200vh',  
+            'color': 'white',  
+            'padding': '30px',
+        })
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# background jobs. With diskcache installed (pip install "dash[diskcache]") the heavy callbacks run as dash background
+# callbacks, each in its own process, so a large upload or export doesn't hold up the server's request threads. They
+# report progress while running and are cancelled when the same callback fires again (new year / month) or a new file
+# is uploaded. Uploads cancel them through last_modified, a cancel input on contents would post every file twice. Jobs
+# find datasets through the file cache, so background mode also needs pyarrow
+
+# dash's DiskcacheManager also needs multiprocess and psutil, without them heavy callbacks run in the request
+BACKGROUND_JOBS = (diskcache is not None and pyarrow is not None
+                   and all(importlib.util.find_spec(name) is not None for name in ('multiprocess', 'psutil')))
+
+#Function to record a heavy callback: a background job when diskcache is installed, a regular callback otherwise.
+#The callback takes set_progress as its first argument either way, called with one value per progress output
+def heavy_callback(*dependencies, progress, cancel=None, **kwargs):
+    def decorator(func):
+        if BACKGROUND_JOBS:     # run by the job manager create_app gives the app
+            return callback(*dependencies, background=True, progress=progress, cancel=cancel, **kwargs)(func)
+
+        def run_in_request(*args):
+            return func(lambda value: None, *args)
+        callback(*dependencies, **kwargs)(run_in_request)
+        return func
+    return decorator
+
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# callback to parse the uploaded files once on the server and hand the browser back only the dataset id. With the
+# append switch on, the files are merged into the dataset already loaded
+
+@heavy_callback(
+        Output('dataset-id', 'data'),
+        Input('upload-data', 'contents'),
+        State('dataset-id', 'data'),
+        State('append-upload', 'value'),
+        progress=[Output('ingest-progress', 'value'), Output('ingest-progress', 'label')],
+)
+def ingest_upload(set_progress, contents, loaded_dataset_id, append):
+    if not contents:
+        return dash.no_update
+    report = lambda fraction, message: set_progress((round(100 * fraction), message))
+    dataset_id = ingest_uploads(contents, loaded_dataset_id if append else None, report)
+    report(0.9, 'Aggregating')
+    dataset_memo(dataset_id, 'cube', build_cube)      # aggregate once here, before the charts ask for it
+    dataset_memo(dataset_id, 'daily', build_daily_rollup)
+    dataset_memo(dataset_id, 'countries', build_country_lookup)
+    report(1, 'Done')
+    return dataset_id
 
 # ------------------------------------------------------------------------------------------------------------------------------
 
 # callback to display entire datatable based on year input
 
-@app.callback(
+@heavy_callback(
         Output('data-table-component', 'children'),
-        Input('upload-data', 'contents'),   
+        Input('dataset-id', 'data'),   
         Input('year-input', 'value'),   
-        
+        Input('month-dropdown', 'value'),
+        progress=Output('data-table-progress', 'children'),
+        cancel=[Input('upload-data', 'last_modified')],
 )
-def make_table(contents, selected_year):
-    if contents is None:
+def make_table(set_progress, dataset_id, selected_year, selected_month):
+    set_progress('Loading the dataset...')
+    raw_df = get_dataset(dataset_id)
+    if raw_df is None:
         return dash.no_update
-    
-    raw_df = read_file(contents)
-    df = raw_df[raw_df['Year'] == selected_year]
     # print(df.Year)
+    set_progress('')
     table = dash_table.DataTable(
                             id='datatable-interactivity',
                             columns=[{
@@ -204,14 +1330,14 @@ def make_table(contents, selected_year):
                                 "deletable": False if i in ["Record ID", "SNo"] else True,  # "Record ID" not deletable
                                 "selectable": True,
                                 "hideable": True
-                            }for i in df.columns],
-                            data=df.to_dict('records'),  
+                            }for i in shown_columns(raw_df.columns)],
+                            data=[],                    # filled page by page by page_datatable
                             editable=False,              # editting inside cell - no
-                            filter_action="native",     
-                            sort_action="native",       
+                            filter_action="custom",     
+                            sort_action="custom",       
                             sort_mode="single",           
                             row_deletable=False,         
-                            page_action="native",       # all data is passed to the table up-front
+                            page_action="custom",       # only the current page is passed to the table
                             page_current=0,             # current pg no.
                             page_size=10,                # rows per page
                             style_cell={                # ensure adequate header width when text is shorter than cell's text
@@ -228,38 +1354,54 @@ def make_table(contents, selected_year):
 
     return table
 
+# callback to serve the page, filter and sort requested by the main datatable
+
+@callback(
+        Output('datatable-interactivity', 'data'),
+        Output('datatable-interactivity', 'page_count'),
+        Input('datatable-interactivity', 'page_current'),
+        Input('datatable-interactivity', 'page_size'),
+        Input('datatable-interactivity', 'sort_by'),
+        Input('datatable-interactivity', 'filter_query'),
+        State('dataset-id', 'data'),
+        State('year-input', 'value'),
+        State('month-dropdown', 'value'),
+)
+def page_datatable(page_current, page_size, sort_by, filter_query, dataset_id, selected_year, selected_month):
+    data, page_count = page_view(dataset_id, 'year', selected_year, selected_month, page_current, page_size, sort_by, filter_query)
+    if data is None:
+        return dash.no_update, dash.no_update
+    return data, page_count
+
 # ------------------------------------------------------------------------------------------------------------------------------
 # callback to display duplicate records
 
-@app.callback(
+@heavy_callback(
         Output('view-duplicate-records', 'children'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'), 
+        Input('month-dropdown', 'value'),
         Input('view-duplicate-button', 'n_clicks'),
+        progress=Output('duplicate-records-progress', 'children'),
+        cancel=[Input('upload-data', 'last_modified')],
         Prevent_initial_call = True
 )
-def display_duplicate_records(contents, selected_year, n_clicks):
-    if contents is None or n_clicks is None:
+def display_duplicate_records(set_progress, dataset_id, selected_year, selected_month, n_clicks):
+    if n_clicks is None:
         return dash.no_update
     
-    raw_df = read_file(contents)
-    df = raw_df[raw_df['Year'] == selected_year]
-    phone_without_null = df[df['Phone Number'].notnull()]
-    duplicate_phone = phone_without_null[phone_without_null.duplicated('Phone Number', keep = False)]
-    
-    # print(duplicate_phone['Phone Number'])
-    # print("..")
-    duplicate_email = df[df.duplicated('Email', keep = False)]
-    # print(duplicate_email['Email'])
-
-    duplicates = pd.concat([duplicate_phone, duplicate_email])
+    set_progress('Finding duplicate records...')
+    raw_df = get_dataset(dataset_id)
+    if raw_df is None:
+        return dash.no_update
+    duplicates = get_view(dataset_id, 'duplicates', selected_year, selected_month)
+    set_progress(f'{len(duplicates)} duplicate records')
 
-    
     return dash_table.DataTable(
         id='duplicate-records-table',
-        columns=[{'name': col, 'id': col} for col in duplicates.columns],
-        data=duplicates.to_dict('records'),
-        page_action="native",       # all data is passed to the table up-front
+        columns=[{'name': col, 'id': col} for col in ['Duplicate Cluster'] + [col for col in shown_columns(raw_df.columns) if col != 'Duplicate Cluster']],
+        data=[],                    # filled page by page by page_duplicate_records
+        page_action="custom",       # only the current page is passed to the table
                             page_current=0,             # current pg no.
                             page_size=10,                # rows per page
                             style_cell={                # ensure adequate header width when text is shorter than cell's text
@@ -274,301 +1416,483 @@ def display_duplicate_records(contents, selected_year, n_clicks):
                             }
     )
 
+@callback(
+        Output('duplicate-records-table', 'data'),
+        Output('duplicate-records-table', 'page_count'),
+        Input('duplicate-records-table', 'page_current'),
+        Input('duplicate-records-table', 'page_size'),
+        State('dataset-id', 'data'),
+        State('year-input', 'value'),
+        State('month-dropdown', 'value'),
+)
+def page_duplicate_records(page_current, page_size, dataset_id, selected_year, selected_month):
+    data, page_count = page_view(dataset_id, 'duplicates', selected_year, selected_month, page_current, page_size, None, None)
+    if data is None:
+        return dash.no_update, dash.no_update
+    return data, page_count
+
 # ------------------------------------------------------------------------------------------------------------------------------
 
 #callback to view and download missing contact owner data
 
-@app.callback(
+@callback(
         Output('view-missing-contact-owner-records', 'children'),
-        Output('download-missing-contact-owner-records', 'data'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'), 
+        Input('month-dropdown', 'value'),
         Input('download-missing-contact-owner-button', 'n_clicks'), 
         Prevent_initial_call = True,     
 )
-def display_and_download_missing_contact_owner_records(contents, selected_year, n_clicks):
-    if n_clicks is None or contents is None:
-        return dash.no_update, dash.no_update
+def display_missing_contact_owner_records(dataset_id, selected_year, selected_month, n_clicks):
+    if n_clicks is None:
+        return dash.no_update
     
-    raw_df = read_file(contents)
-    df = raw_df[raw_df['Year'] == selected_year]
+    missing_contact_owner = get_view(dataset_id, 'missing-owner', selected_year, selected_month)
+    if missing_contact_owner is None:
+        return dash.no_update
 
-    missing_contact_owner = df[df['Contact owner'].isna()]
-    missing_contact_owner_table = dash_table.DataTable(id = 'duplicates-table',
+    missing_contact_owner_table = dash_table.DataTable(id = 'missing-contact-owner-table',
                                             columns = [{
                                                 "name": i,
                                                 "id": i,
                                                 "deletable": False if i in ["Record ID", "SNo"] else True,
                                                 "selectable": True,
                                                 "hideable": True
-                                            }for i in missing_contact_owner.columns],
-                                            data = missing_contact_owner.to_dict('records'),
+                                            }for i in shown_columns(missing_contact_owner.columns)],
+                                            data = [],
                                             editable=False,
-                                            filter_action="native",     
-                                            sort_action="native",       
+                                            filter_action="custom",     
+                                            sort_action="custom",       
                                             sort_mode="single",           
                                             row_deletable=False,         
-                                            page_action="native",
+                                            page_action="custom",
+                                            page_current=0,
+                                            page_size=250,
                                             style_cell={'minWidth': 95, 
                                                         'maxWidth': 95, 
                                                         'width': 95,
                                                         'color': 'black',},
                                             style_data={'whiteSpace': 'normal',}
                                         )
-    def to_xlsx(bytes_io):
-        xslx_writer = pd.ExcelWriter(bytes_io, engine="xlsxwriter")  
-        missing_contact_owner.to_excel(xslx_writer, index=False, sheet_name="sheet1")
-        xslx_writer.close()
+    return missing_contact_owner_table
+
+# the download only fires on a click of the button, a new upload or year just refreshes the table above.
+# The file comes from the export cache, so downloading the same records again doesn't rewrite it
+
+@heavy_callback(
+        Output('download-missing-contact-owner-records', 'data'),
+        Input('download-missing-contact-owner-button', 'n_clicks'), 
+        State('dataset-id', 'data'),
+        State('year-input', 'value'), 
+        State('month-dropdown', 'value'),
+        progress=Output('missing-contact-owner-progress', 'children'),
+        cancel=[Input('upload-data', 'last_modified')],
+        Prevent_initial_call = True,     
+)
+def download_missing_contact_owner_records(set_progress, n_clicks, dataset_id, selected_year, selected_month):
+    if n_clicks is None:
+        return dash.no_update
+    path = export_view(dataset_id, 'missing-owner', selected_year, selected_month, 'xlsx',
+                       lambda fraction, message: set_progress(message))
+    set_progress('')
+    if path is None:
+        return dash.no_update
+    return dcc.send_file(path, filename="missing_contact_owner_records.xlsx")
+
+@callback(
+        Output('missing-contact-owner-table', 'data'),
+        Output('missing-contact-owner-table', 'page_count'),
+        Input('missing-contact-owner-table', 'page_current'),
+        Input('missing-contact-owner-table', 'page_size'),
+        Input('missing-contact-owner-table', 'sort_by'),
+        Input('missing-contact-owner-table', 'filter_query'),
+        State('dataset-id', 'data'),
+        State('year-input', 'value'),
+        State('month-dropdown', 'value'),
+)
+def page_missing_contact_owner_records(page_current, page_size, sort_by, filter_query, dataset_id, selected_year, selected_month):
+    data, page_count = page_view(dataset_id, 'missing-owner', selected_year, selected_month, page_current, page_size, sort_by, filter_query)
+    if data is None:
+        return dash.no_update, dash.no_update
+    return data, page_count
 
-    return missing_contact_owner_table, dcc.send_bytes(to_xlsx, "missing_contact_owner_records.xlsx")
+# ------------------------------------------------------------------------------------------------------------------------------
+
+#callback to export the selected records of the selected year / month as xlsx or csv
+
+@heavy_callback(
+        Output('export-download', 'data'),
+        Input('export-button', 'n_clicks'),
+        State('export-view', 'value'),
+        State('export-format', 'value'),
+        State('dataset-id', 'data'),
+        State('year-input', 'value'),
+        State('month-dropdown', 'value'),
+        progress=Output('export-progress', 'children'),
+        cancel=[Input('upload-data', 'last_modified')],
+        Prevent_initial_call = True,
+)
+def export_records(set_progress, n_clicks, view, file_format, dataset_id, selected_year, selected_month):
+    if n_clicks is None:
+        return dash.no_update
+    path = export_view(dataset_id, view, selected_year, selected_month, file_format,
+                       lambda fraction, message: set_progress(message))
+    set_progress('')
+    if path is None:
+        return dash.no_update
+    return dcc.send_file(path, filename=export_filename(view, selected_year, selected_month, file_format))
 
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
+@callback(
         Output('country-map', 'figure'),
-        Input('upload-data', 'contents'),
+        Output('unmatched-countries', 'children'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
-        return dash.no_update
-    df = read_file(contents)
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
+        return dash.no_update, dash.no_update
 
-    filtered_df = df[df['Year'] == selected_year]
-    
-    country_counts = filtered_df['Country/Region'].value_counts().reset_index()
-    country_counts.columns = ['Country/Region', 'Lead Count']
-
-    fig = px.choropleth(country_counts, 
-                    locations='Country/Region',  
-                    locationmode='country names', 
-                    color='Lead Count',  
-                    hover_name='Country/Region',  
-                    color_continuous_scale=px.colors.sequential.Plasma,
-                    title='Country-wise Lead Distribution Map')
-    fig.update_layout(title_font_size=20)
-    fig.update_geos(
-        resolution=110,                     # Adjust the map resolution
-        showcountries=True,                  # Show country borders
-        countrycolor="gray",                 # Set country border color
-        showsubunits=True,                  # Show subunit borders
-        subunitcolor="gray",                # Set subunit border color
-    )
-    return fig
+    country_counts, unmatched = country_code_counts(dataset_id, aggregates['counts']['Country/Region'])
+    unmatched_text = ', '.join(f"{value} ({count})" for value, count in zip(unmatched['Country/Region'], unmatched['Lead Count']))
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.choropleth(country_counts, 
+                        locations='ISO-3',  
+                        locationmode='ISO-3', 
+                        color='Lead Count',  
+                        hover_name='Country',  
+                        color_continuous_scale=px.colors.sequential.Plasma,
+                        title='Country-wise Lead Distribution Map')
+        fig.update_layout(title_font_size=20)
+        fig.update_geos(
+            resolution=110,                     # Adjust the map resolution
+            showcountries=True,                  # Show country borders
+            countrycolor="gray",                 # Set country border color
+            showsubunits=True,                  # Show subunit borders
+            subunitcolor="gray",                # Set subunit border color
+        )
+        return fig
+
+    return (chart_figure(dataset_id, selected_year, selected_month, 'country-map', build_figure),
+            f"Countries not shown on the map: {unmatched_text}" if unmatched_text else '')
 
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
+@callback(
         Output('country-pie-chart', 'figure'),
         Output('missing-country-count', 'children'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
         return dash.no_update, dash.no_update
-    df = read_file(contents)
-
-    filtered_df = df[df['Year'] == selected_year]
-    country_counts = filtered_df['Country/Region'].value_counts().reset_index()
-    country_counts.columns = ['Country/Region', 'Lead Count'] #cols in country_counts = country/reg and lead count 
-
-    missing_data_count = len(filtered_df[filtered_df['Country/Region'].isna()]) 
-    fig = px.pie(country_counts, names='Country/Region', values='Lead Count', title='Country-wise Lead Distribution')
-
-    fig.update_layout(
-                title_font_size=20, 
-                margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
-                showlegend=True,                  
-                legend=dict(title="Countries: "), 
-            )
-
-    fig.update_traces(
-                textinfo='percent+label',  # text displayed in pie slices
-                marker=dict(
-                    line=dict(color='black', width=3)  # Add a white border around the slices
+
+    country_counts = aggregates['counts']['Country/Region'] #cols in country_counts = country/reg and lead count 
+    missing_data_count = aggregates['missing']['Country/Region']
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.pie(country_counts, names='Country/Region', values='Lead Count', title='Country-wise Lead Distribution')
+
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
+                    showlegend=True,                  
+                    legend=dict(title="Countries: "), 
+                )
+
+        fig.update_traces(
+                    textinfo='percent+label',  # text displayed in pie slices
+                    marker=dict(
+                        line=dict(color='black', width=3)  # Add a white border around the slices
+                    )
                 )
-            )
-    return fig, f"Missing Country Data Count: {missing_data_count}"
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, 'country-pie-chart', build_figure), f"Missing Country Data Count: {missing_data_count}"
 
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
+@callback(
         Output('lead-source-pie-chart', 'figure'),
         Output('missing-leadsource-count', 'children'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
         return dash.no_update, dash.no_update
-    df = read_file(contents)
-    filtered_df = df[df['Year'] == selected_year]
-    country_counts = filtered_df['Lead Source'].value_counts().reset_index()
-    country_counts.columns = ['Lead Source', 'Lead Count']
-
-    missing_data_count = len(filtered_df[filtered_df['Lead Source'].isna()]) 
-    fig = px.pie(country_counts, names='Lead Source', values='Lead Count', title='Lead Source-wise Lead Distribution')
-    fig.update_layout(
-                title_font_size=20, 
-                margin=dict(l=0, r=0, b=20, t=40),  
-                showlegend=True,                  
-                legend=dict(title="Lead Souces: "), 
-            )
-
-    fig.update_traces(
-                textinfo='percent+label',  
-                marker=dict(
-                    line=dict(color='black', width=3)  
+    country_counts = aggregates['counts']['Lead Source']
+    missing_data_count = aggregates['imputed']['Lead Source']       # blank sources are filled in as Facebook at ingest
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.pie(country_counts, names='Lead Source', values='Lead Count', title='Lead Source-wise Lead Distribution')
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  
+                    showlegend=True,                  
+                    legend=dict(title="Lead Souces: "), 
+                )
+
+        fig.update_traces(
+                    textinfo='percent+label',  
+                    marker=dict(
+                        line=dict(color='black', width=3)  
+                    )
                 )
-            )
-    return fig, f"Missing Lead Source Data Count: {missing_data_count}"
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, 'lead-source-pie-chart', build_figure), f"Missing Lead Source Data Count: {missing_data_count} (counted as Facebook)"
 
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
+@callback(
         Output('contact-owner-pie-chart', 'figure'),
         Output('missing-contactowner-count', 'children'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
         return dash.no_update, dash.no_update
-    df = read_file(contents)
-    filtered_df = df[df['Year'] == selected_year]
-    country_counts = filtered_df['Contact owner'].value_counts().reset_index()
-    country_counts.columns = ['Contact owner', 'Lead Count']
-
-    missing_data_count = len(filtered_df[filtered_df['Contact owner'].isna()]) 
-    fig = px.pie(country_counts, names='Contact owner', values='Lead Count', title='Contact Owner-wise Lead Distribution')
-    fig.update_layout(
-                title_font_size=20, 
-                margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
-                showlegend=True,                  
-                legend=dict(title="Contact Owners: "), 
-            )
-
-    fig.update_traces(
-                textinfo='percent+label',  # text displayed in pie slices
-                marker=dict(
-                    line=dict(color='black', width=3)  # Add a white border around the slices
+    country_counts = aggregates['counts']['Contact owner']
+    missing_data_count = aggregates['missing']['Contact owner']
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.pie(country_counts, names='Contact owner', values='Lead Count', title='Contact Owner-wise Lead Distribution')
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
+                    showlegend=True,                  
+                    legend=dict(title="Contact Owners: "), 
+                )
+
+        fig.update_traces(
+                    textinfo='percent+label',  # text displayed in pie slices
+                    marker=dict(
+                        line=dict(color='black', width=3)  # Add a white border around the slices
+                    )
                 )
-            )
-    return fig, f"Missing Contact Owner Data Count: {missing_data_count}"
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, 'contact-owner-pie-chart', build_figure), f"Missing Contact Owner Data Count: {missing_data_count}"
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
+@callback(
         Output('lead-status-pie-chart', 'figure'),
         Output('missing-leadstatus-count', 'children'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
         return dash.no_update, dash.no_update
-    df = read_file(contents)
-    filtered_df = df[df['Year'] == selected_year]
-    country_counts = filtered_df['Lead Status'].value_counts().reset_index()
-    country_counts.columns = ['Lead Status', 'Lead Count']
-
-    missing_data_count = len(filtered_df[filtered_df['Lead Status'].isna()]) 
-    fig = px.pie(country_counts, names='Lead Status', values='Lead Count', title='Lead Status-wise Lead Distribution')
-    fig.update_layout(
-                title_font_size=20, 
-                margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
-                showlegend=True,                  
-                legend=dict(title="Lead Status"), 
-            )
-
-    fig.update_traces(
-                textinfo='percent+label',  # text displayed in pie slices
-                marker=dict(
-                    line=dict(color='black', width=3)  # Add a white border around the slices
+    country_counts = aggregates['counts']['Lead Status']
+    missing_data_count = aggregates['missing']['Lead Status']
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.pie(country_counts, names='Lead Status', values='Lead Count', title='Lead Status-wise Lead Distribution')
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
+                    showlegend=True,                  
+                    legend=dict(title="Lead Status"), 
+                )
+
+        fig.update_traces(
+                    textinfo='percent+label',  # text displayed in pie slices
+                    marker=dict(
+                        line=dict(color='black', width=3)  # Add a white border around the slices
+                    )
                 )
-            )
-    return fig, f"Missing Lead Status Data Count: {missing_data_count}"
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, 'lead-status-pie-chart', build_figure), f"Missing Lead Status Data Count: {missing_data_count}"
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
+@callback(
         Output('month-pie-chart', 'figure'),
-        Input('upload-data', 'contents'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
         return dash.no_update
-    df = read_file(contents)
-    filtered_df = df[df['Year'] == selected_year].copy()
-    filtered_df['Create Date'] = pd.to_datetime(filtered_df['Create Date'])
-    filtered_df['Month'] = filtered_df['Create Date'].dt.strftime('%B')
-    month_counts = filtered_df['Month'].value_counts().reset_index()
-    month_counts.columns = ['Month', 'Lead Count']
-    fig = px.pie(month_counts, names='Month', values='Lead Count', title='Create Date-wise Lead Distribution')
-    fig.update_layout(
-                title_font_size=20, 
-                margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
-                showlegend=True,                  
-                legend=dict(title="Months: "), 
-            )
-
-    fig.update_traces(
-                textinfo='percent+label',  # text displayed in pie slices
-                marker=dict(
-                    line=dict(color='black', width=3)  # Add a white border around the slices
+    month_counts = aggregates['counts']['Month']
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.pie(month_counts, names='Month', values='Lead Count', title='Create Date-wise Lead Distribution')
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
+                    showlegend=True,                  
+                    legend=dict(title="Months: "), 
+                )
+
+        fig.update_traces(
+                    textinfo='percent+label',  # text displayed in pie slices
+                    marker=dict(
+                        line=dict(color='black', width=3)  # Add a white border around the slices
+                    )
                 )
-            )
-    return fig
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, 'month-pie-chart', build_figure)
 # ------------------------------------------------------------------------------------------------------------------------------
 
-@app.callback(
-        Output('age-pie-chart', 'figure'),
-        Input('upload-data', 'contents'),
+@callback(
+        Output('trend-chart', 'figure'),
+        Input('dataset-id', 'data'),
         Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
+        Input('trend-granularity', 'value'),
+        Input('trend-breakdown', 'value'),
+        Input('trend-range', 'value'),
         Prevent_initial_call = True,      
 )
-def make_pie_chart(contents, selected_year):
-    if contents is None:
+def make_trend_chart(dataset_id, selected_year, selected_month, granularity, breakdown, trend_range):
+    if trend_range == 'all':
+        selected_year, selected_month = None, None
+    trend = trend_counts(dataset_id, selected_year, selected_month, granularity, breakdown)
+    if trend is None:
         return dash.no_update
-    
-    df = read_file(contents)
-    filtered_df = df[df['Year'] == selected_year].copy()
-    filtered_df['Age of your Child'] = pd.to_numeric(filtered_df['Age of your Child'], errors='coerce')
-    def categorize_age(age):
-        if age <= 10:
-            return "Ages <= 10"
-        elif 11 <= age <= 19:
-            return "11 <= Ages <= 19"
-        elif 20 <= age <= 22:
-            return "20 <= Ages <= 22"
-        else:
-            return "Age > 22"
-
-    filtered_df['Age Group'] = filtered_df['Age of your Child'].apply(categorize_age)
-    age_group_counts = filtered_df['Age Group'].value_counts().reset_index()
-    age_group_counts.columns = ['Age Group', 'Lead Count']
-
-    fig = px.pie(age_group_counts, names='Age Group', values='Lead Count', title='Age-wise Lead Distribution')
-    fig.update_layout(
-                title_font_size=20, 
-                margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
-                showlegend=True,                  
-                legend=dict(title="Age groups: "), 
-            )
-    fig.update_traces(
-                textinfo='percent+label',  # text displayed in pie slices
-                marker=dict(
-                    line=dict(color='black', width=3)  # Add a white border around the slices
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.line(trend, x='Date', y='Lead Count', color=breakdown if breakdown in TREND_BREAKDOWNS else None,
+                      markers=granularity != 'day', title=f'Leads per {granularity.capitalize()}')
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
+                    showlegend=breakdown in TREND_BREAKDOWNS,                  
+                    legend=dict(title=f"{breakdown}: "), 
+                    xaxis_title=None,
+                )
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, f'trend-chart-{granularity}-{breakdown}', build_figure)
+# ------------------------------------------------------------------------------------------------------------------------------
+
+#callback to show the data quality profile of the selected period, read from the aggregate cube
+@callback(
+        Output('data-quality-table', 'data'),
+        Input('dataset-id', 'data'),
+        Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
+        Prevent_initial_call = True,      
+)
+def show_data_quality(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
+        return dash.no_update
+    return quality_rows(aggregates)
+# ------------------------------------------------------------------------------------------------------------------------------
+
+@callback(
+        Output('age-pie-chart', 'figure'),
+        Output('inconsistent-values', 'children'),
+        Input('dataset-id', 'data'),
+        Input('year-input', 'value'),
+        Input('month-dropdown', 'value'),
+        Prevent_initial_call = True,      
+)
+def make_pie_chart(dataset_id, selected_year, selected_month):
+    aggregates = period_aggregates(dataset_id, selected_year, selected_month)
+    if aggregates is None:
+        return dash.no_update, dash.no_update
+    age_group_counts = aggregates['counts']['Age Group']
+    unknown_age_count = aggregates['missing']['Age Group']     # ages left blank, typed as text or negative
+
+    def build_figure():
+        import plotly.express as px
+
+        fig = px.pie(age_group_counts, names='Age Group', values='Lead Count', title='Age-wise Lead Distribution')
+        fig.update_layout(
+                    title_font_size=20, 
+                    margin=dict(l=0, r=0, b=20, t=40),  # chart's margins
+                    showlegend=True,                  
+                    legend=dict(title="Age groups: "), 
+                )
+        fig.update_traces(
+                    textinfo='percent+label',  # text displayed in pie slices
+                    marker=dict(
+                        line=dict(color='black', width=3)  # Add a white border around the slices
+                    )
                 )
-            )
-    return fig
+        return fig
+
+    return chart_figure(dataset_id, selected_year, selected_month, 'age-pie-chart', build_figure), f"Missing or Inconsistent Age Data Count: {unknown_age_count}"
+# ------------------------------------------------------------------------------------------------------------------------------
+
+#Function to build the dash app: its layout, background job manager and every callback recorded above
+def create_app():
+    manager = dash.DiskcacheManager(diskcache.Cache(os.path.join(CACHE_DIR, 'background-jobs'))) if BACKGROUND_JOBS else None
+    app = dash.Dash(__name__, external_stylesheets = [dbc.themes.MORPH],
+                    suppress_callback_exceptions=True,    # the tables filled by the paging callbacks are rendered by other callbacks
+                    background_callback_manager=manager)
+    app.layout = build_layout()
+    for dependencies, kwargs, func in _callbacks:
+        app.callback(*dependencies, **kwargs)(func)
+    if METRICS_ENABLED:
+        install_metrics(app.server)
+    return app
+
+_app = None
+_app_lock = threading.Lock()
+
+#Function to create the module level app (sales_dashboard.app) the first time it is looked up
+def __getattr__(name):
+    global _app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+    return _app
 # ------------------------------------------------------------------------------------------------------------------------------
 
 if __name__ == '__main__':
-    app.run_server(debug=True)
+    parser = argparse.ArgumentParser(description='Sales Dashboard')
+    subcommands = parser.add_subparsers(dest='command')
+    ingest_parser = subcommands.add_parser('ingest', help='parse a folder of lead exports into the file cache ahead of time')
+    ingest_parser.add_argument('folder', help='folder containing the .xlsx exports')
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        if pyarrow is None:         # nothing would be kept, the file cache is written with pyarrow
+            parser.error('ingest needs pyarrow installed (pip install pyarrow)')
+        ingest_folder(args.folder)
+    else:
+        create_app().run_server(debug=True)     # development server, see wsgi.py for production
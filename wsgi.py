@@ -0,0 +1,15 @@
+# production entry point, served with several worker processes by gunicorn (settings in gunicorn.conf.py):
+#
+#   gunicorn -c gunicorn.conf.py wsgi:server
+#
+# Every worker imports the dashboard on its own. Parsed files (pyarrow) and derived aggregates (diskcache) live under
+# SALES_DASH_CACHE_DIR, so a file uploaded through one worker is parsed once and every other worker reads it back from
+# there: install both for more than one worker, and point all workers at the same cache directory. Without pyarrow
+# gunicorn.conf.py runs a single worker, and refuses to start with more.
+
+from sales_dashboard import create_app
+
+app = create_app()
+app.enable_dev_tools(debug=False)       # no debug UI, hot reload or dev bundles, whatever DASH_* variables are set
+
+server = app.server